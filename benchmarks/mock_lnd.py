@@ -0,0 +1,309 @@
+"""Mock LND REST server serving a synthetic node for benchmarks."""
+from json import dumps, loads
+from time import sleep
+from random import Random
+from base64 import b64encode, urlsafe_b64decode
+from pathlib import Path
+from queue import Queue, Empty
+from threading import Lock
+from subprocess import run, DEVNULL
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import ssl
+import argparse
+
+
+class MockLnd:
+
+    def __init__(self, channels=100, latency=0.0, seed=0):
+        random = Random(seed)
+        self.latency = latency
+        self.lock = Lock()
+        self.stats = {}
+        self.streams = {'v1/channels/subscribe': [], 'v2/router/htlcevents': []}
+        self.pubkey = '02' + random.getrandbits(256).to_bytes(32, 'big').hex()
+
+        self.nodes = {}
+        self.channels = []
+        self.edges = {}
+        for index in range(channels):
+            # One peer out of ten has a second channel.
+            if index and index % 10 == 0:
+                pubkey = self.channels[index - 1]['remote_pubkey']
+            else:
+                pubkey = '03' + random.getrandbits(256).to_bytes(32, 'big').hex()
+                self.nodes[pubkey] = {'pub_key': pubkey, 'alias': f'peer{index:05d}', 'color': '#3399ff'}
+
+            capacity = random.randint(1, 16) * 1_000_000
+            local_balance = int(capacity * random.random())
+            chan_id = str(700_000 << 40 | index << 16)
+            self.channels.append({
+                'active': random.random() > 0.05,
+                'remote_pubkey': pubkey,
+                'channel_point': f'{random.getrandbits(256):064x}:0',
+                'chan_id': chan_id,
+                'capacity': str(capacity),
+                'local_balance': str(local_balance),
+                'remote_balance': str(capacity - local_balance - 3_000),
+                'local_chan_reserve_sat': str(capacity // 100),
+                'remote_chan_reserve_sat': str(capacity // 100)
+            })
+            self.edges[chan_id] = {
+                'channel_id': chan_id,
+                'node1_pub': self.pubkey,
+                'node2_pub': pubkey,
+                'capacity': str(capacity),
+                'node1_policy': {
+                    'fee_base_msat': '1000', 'fee_rate_milli_msat': str(random.randint(0, 2_000)), 'disabled': False
+                },
+                'node2_policy': {
+                    'fee_base_msat': '1000', 'fee_rate_milli_msat': str(random.randint(0, 2_000)), 'disabled': False
+                }
+            }
+        self.hub = '02' + random.getrandbits(256).to_bytes(32, 'big').hex()
+        self.nodes[self.hub] = {'pub_key': self.hub, 'alias': 'hub', 'color': '#3399ff'}
+
+        # Routes go through the hub, which has a channel with every peer.
+        self.graph = list(self.edges.values())
+        for index, pubkey in enumerate(sorted(set(channel['remote_pubkey'] for channel in self.channels))):
+            self.graph.append({
+                'channel_id': str(800_000 << 40 | index << 16),
+                'node1_pub': self.hub,
+                'node2_pub': pubkey,
+                'capacity': str(random.randint(1, 16) * 1_000_000),
+                'node1_policy': {
+                    'fee_base_msat': '1000', 'fee_rate_milli_msat': str(random.randint(0, 2_000)), 'disabled': False
+                },
+                'node2_policy': {
+                    'fee_base_msat': '1000', 'fee_rate_milli_msat': str(random.randint(0, 2_000)), 'disabled': False
+                }
+            })
+        self.nodes[self.pubkey] = {'pub_key': self.pubkey, 'alias': 'mock', 'color': '#3399ff'}
+        self.opened = channels
+
+    def count(self, endpoint: str):
+        with self.lock:
+            self.stats[endpoint] = self.stats.get(endpoint, 0) + 1
+
+    def get(self, path: str, query: dict) -> tuple:
+        parts = path.strip('/').split('/')
+        if path == '/v1/getinfo':
+            return 'v1/getinfo', {'identity_pubkey': self.pubkey, 'alias': 'mock', 'num_active_channels': len(self.channels)}
+        elif path == '/v1/channels':
+            channels = self.channels
+            if query.get('peer'):
+                pubkey = urlsafe_b64decode(query['peer'][0]).hex()
+                channels = [channel for channel in channels if channel['remote_pubkey'] == pubkey]
+            return 'v1/channels', {'channels': channels}
+        elif path == '/v1/graph':
+            return 'v1/graph', {'nodes': list(self.nodes.values()), 'edges': self.graph}
+        elif parts[:3] == ['v1', 'graph', 'edge']:
+            return 'v1/graph/edge', self.edges.get(parts[3], {'code': 5, 'message': 'edge not found'})
+        elif parts[:3] == ['v1', 'graph', 'node']:
+            node = self.nodes.get(parts[3])
+            return 'v1/graph/node', {'node': node} if node else {'code': 5, 'message': 'node not found'}
+        elif parts[:3] == ['v1', 'graph', 'routes']:
+            return 'v1/graph/routes', self.get_routes(query, int(parts[4]))
+        return path, {'code': 5, 'message': 'not found'}
+
+    def get_routes(self, query: dict, amount: int) -> dict:
+        channel_out = [channel for channel in self.channels if channel['chan_id'] == query['outgoing_chan_id'][0]]
+        last_hop = urlsafe_b64decode(query['last_hop_pubkey'][0]).hex()
+        if not channel_out:
+            return {'code': 2, 'message': 'unable to find a path to destination'}
+        hops = [
+            {'chan_id': channel_out[0]['chan_id'], 'pub_key': channel_out[0]['remote_pubkey']},
+            {'chan_id': '1', 'pub_key': self.hub},
+            {'chan_id': '2', 'pub_key': last_hop},
+            {'chan_id': '3', 'pub_key': self.pubkey}
+        ]
+        for index, hop in enumerate(hops):
+            hop['amt_to_forward_msat'] = str(amount * 1000 + (len(hops) - index - 1) * 1000)
+        return {'routes': [{'total_amt_msat': str(amount * 1000 + 3000), 'total_fees_msat': '3000', 'hops': hops}]}
+
+    def post(self, path: str, data: dict) -> tuple:
+        if path == '/v1/invoices':
+            return 'v1/invoices', {
+                'r_hash': b64encode(bytes(32)).decode(),
+                'payment_request': 'lnbcrt1mock',
+                'payment_addr': b64encode(bytes(32)).decode()
+            }
+        elif path == '/v2/router/route/send':
+            return 'v2/router/route/send', {'status': 'SUCCEEDED', 'route': data.get('route')}
+        return path, {'code': 5, 'message': 'not found'}
+
+    def get_channel(self, chan_id: str) -> dict:
+        return next((channel for channel in self.channels if channel['chan_id'] == chan_id), None)
+
+    def emit(self, path: str, event: dict):
+        with self.lock:
+            for queue in self.streams[path]:
+                queue.put(event)
+
+    def apply(self, event: dict) -> dict:
+        # Scripted events change the node first, then reach the subscribers like LND would send them.
+        with self.lock:
+            if event['type'] == 'settle':
+                amount = int(event['amount'])
+                for chan_id, sign in ((event['chan_id_in'], 1), (event['chan_id_out'], -1)):
+                    channel = self.get_channel(chan_id)
+                    channel['local_balance'] = str(int(channel['local_balance']) + sign * amount)
+                    channel['remote_balance'] = str(int(channel['remote_balance']) - sign * amount)
+            elif event['type'] == 'close':
+                channel = self.get_channel(event['chan_id'])
+                self.channels.remove(channel)
+            elif event['type'] in ('inactive', 'active'):
+                channel = self.get_channel(event['chan_id'])
+                channel['active'] = event['type'] == 'active'
+            elif event['type'] == 'open':
+                peer = self.get_channel(event['chan_id_peer'])
+                channel = dict(
+                    peer, active=True, chan_id=str(700_000 << 40 | self.opened << 16),
+                    channel_point=f'{self.opened:064x}:0'
+                )
+                self.edges[channel['chan_id']] = dict(self.edges[peer['chan_id']], channel_id=channel['chan_id'])
+                self.channels.append(channel)
+                self.opened += 1
+            else:
+                return {'code': 3, 'message': f'unknown event {event["type"]}'}
+
+        if event['type'] == 'settle':
+            self.emit('v2/router/htlcevents', {
+                'incoming_channel_id': event['chan_id_in'],
+                'outgoing_channel_id': event['chan_id_out'],
+                'event_type': 'FORWARD',
+                'settle_event': {}
+            })
+        elif event['type'] == 'close':
+            self.emit('v1/channels/subscribe', {
+                'type': 'CLOSED_CHANNEL',
+                'closed_channel': {'chan_id': channel['chan_id'], 'channel_point': channel['channel_point']}
+            })
+        elif event['type'] in ('inactive', 'active'):
+            # Channel points are sent as reversed txid bytes, like the REST proxy of LND does.
+            funding_txid, output_index = channel['channel_point'].split(':')
+            self.emit('v1/channels/subscribe', {
+                'type': f'{event["type"].upper()}_CHANNEL',
+                f'{event["type"]}_channel': {
+                    'funding_txid_bytes': b64encode(bytes.fromhex(funding_txid)[::-1]).decode(),
+                    'output_index': int(output_index)
+                }
+            })
+        elif event['type'] == 'open':
+            self.emit('v1/channels/subscribe', {'type': 'OPEN_CHANNEL', 'open_channel': channel})
+        return {'chan_id': channel['chan_id']}
+
+    def subscribe(self, path: str, write: object):
+        queue = Queue()
+        with self.lock:
+            self.streams[path].append(queue)
+        try:
+            while True:
+                try:
+                    event = queue.get(timeout=1)
+                except Empty:
+                    continue
+                write(dumps({'result': event}) + '\n')
+        except OSError:
+            pass
+        finally:
+            with self.lock:
+                self.streams[path].remove(queue)
+
+    def handler(self) -> type:
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def reply(self, body: dict):
+                body = dumps(body).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def write_chunk(self, data: str):
+                data = data.encode()
+                self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+                self.wfile.flush()
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path == '/bench/stats':
+                    return self.reply(mock.stats)
+                if url.path == '/bench/streams':
+                    with mock.lock:
+                        return self.reply({path: len(queues) for path, queues in mock.streams.items()})
+                if url.path in ('/v1/channels/subscribe', '/v2/router/htlcevents'):
+                    # Streams stay open, events posted to /bench/event are sent as chunks.
+                    self.send_response(200)
+                    self.send_header('Transfer-Encoding', 'chunked')
+                    self.end_headers()
+                    self.wfile.flush()
+                    return mock.subscribe(url.path.strip('/'), self.write_chunk)
+                sleep(mock.latency)
+                endpoint, body = mock.get(url.path, parse_qs(url.query))
+                mock.count(endpoint)
+                self.reply(body)
+
+            def do_POST(self):
+                data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if self.path == '/bench/reset':
+                    mock.stats.clear()
+                    return self.reply({})
+                if self.path == '/bench/event':
+                    return self.reply(mock.apply(loads(data)))
+                sleep(mock.latency)
+                endpoint, body = mock.post(self.path, loads(data) if data else {})
+                mock.count(endpoint)
+                self.reply(body)
+
+        return Handler
+
+
+def write_lnddir(lnddir: str, network='mainnet') -> Path:
+    lnddir = Path(lnddir)
+    macaroon = lnddir / 'data' / 'chain' / 'bitcoin' / network / 'admin.macaroon'
+    macaroon.parent.mkdir(parents=True, exist_ok=True)
+    macaroon.write_bytes(b'mock')
+    if not (lnddir / 'tls.cert').exists():
+        run([
+            'openssl', 'req', '-x509', '-newkey', 'ec', '-pkeyopt', 'ec_paramgen_curve:prime256v1', '-nodes',
+            '-keyout', str(lnddir / 'tls.key'), '-out', str(lnddir / 'tls.cert'), '-days', '30',
+            '-subj', '/CN=localhost', '-addext', 'subjectAltName=IP:127.0.0.1,DNS:localhost',
+            '-addext', 'basicConstraints=critical,CA:TRUE', '-addext', 'keyUsage=digitalSignature,keyCertSign'
+        ], check=True, stdout=DEVNULL, stderr=DEVNULL)
+    return lnddir
+
+
+def serve(mock: MockLnd, lnddir: str, port=8080):
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(f'{lnddir}/tls.cert', f'{lnddir}/tls.key')
+    server = ThreadingHTTPServer(('127.0.0.1', port), mock.handler())
+    server.daemon_threads = True
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--channels', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every request.')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--lnddir', default='./mock-lnd')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    lnddir = write_lnddir(args.lnddir)
+    serve(MockLnd(channels=args.channels, latency=args.latency, seed=args.seed), lnddir, args.port)
+
+
+if __name__ == '__main__':
+    main()
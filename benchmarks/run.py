@@ -0,0 +1,199 @@
+"""Measure wall time, REST requests and peak memory against the mock LND server.
+
+    python benchmarks/run.py --channels 10 100 1000 5000 --latency 0.002
+"""
+from os import environ
+from sys import executable, path
+from time import sleep, perf_counter
+from pathlib import Path
+from tempfile import TemporaryDirectory, mkdtemp
+from subprocess import Popen
+
+import argparse
+import tracemalloc
+
+path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+from click.testing import CliRunner
+from requests import get, post
+from requests.exceptions import RequestException
+from rich.table import Table
+from rich.console import Console
+
+from autorebalance.cli import cli
+from autorebalance.executor import BosExecutor
+from autorebalance.state import ChannelState
+from autorebalance.rebalance import Lnd, Rebalance
+
+import mock_lnd
+
+BOS = str(Path(__file__).resolve().parent / 'bos')
+
+
+class Server:
+
+    def __init__(self, channels: int, latency: float, port: int, lnddir: str):
+        self.url = f'https://127.0.0.1:{port}'
+        self.rpc = f'127.0.0.1:{port}'
+        self.lnddir = str(mock_lnd.write_lnddir(lnddir))
+        self.process = Popen([
+            executable, mock_lnd.__file__, '--channels', str(channels), '--latency', str(latency),
+            '--port', str(port), '--lnddir', self.lnddir
+        ])
+        for _ in range(100):
+            try:
+                self.stats()
+                return
+            except RequestException:
+                sleep(0.1)
+        raise RuntimeError('Mock LND server did not start.')
+
+    def stats(self) -> dict:
+        return get(f'{self.url}/bench/stats', verify=f'{self.lnddir}/tls.cert').json()
+
+    def reset(self):
+        post(f'{self.url}/bench/reset', verify=f'{self.lnddir}/tls.cert')
+
+    def streams(self) -> dict:
+        return get(f'{self.url}/bench/streams', verify=f'{self.lnddir}/tls.cert').json()
+
+    def event(self, **event) -> dict:
+        return post(f'{self.url}/bench/event', json=event, verify=f'{self.lnddir}/tls.cert').json()
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait()
+
+
+def measure(server: Server, function: object) -> dict:
+    # Memory is traced in a second run, tracemalloc would slow down the timed one.
+    server.reset()
+    timestamp = perf_counter()
+    function()
+    elapsed = perf_counter() - timestamp
+    requests = sum(server.stats().values())
+
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'time': elapsed, 'requests': requests, 'memory': peak / pow(1024, 2)}
+
+
+def bench_listchannels(server: Server, home: str):
+    result = CliRunner().invoke(
+        cli, ['--lnddir', server.lnddir, '--rpc', server.rpc, 'listchannels'], env={'HOME': home}
+    )
+    if result.exit_code:
+        raise RuntimeError(result.output)
+
+
+def bench_low_outbound(server: Server):
+    with Lnd(lnddir=server.lnddir, rpc=server.rpc) as lightning:
+        rebalance = Rebalance(lnd=lightning)
+        rebalance.get_list_channels_low_outbound()
+        rebalance.snapshot.state.stop()
+
+
+def bench_cycle(server: Server, executor: object):
+    with Lnd(lnddir=server.lnddir, rpc=server.rpc) as lightning:
+        rebalance = Rebalance(
+            lnd=lightning, amount=50_000, fee_limit_fixed=10, max_total_fees=5_000, limit_rebalance=10,
+            executor=executor
+        )
+        rebalance.run()
+        rebalance.snapshot.state.stop()
+
+
+def wait(condition: object, message: str, timeout=10):
+    for _ in range(int(timeout * 100)):
+        if condition():
+            return
+        sleep(0.01)
+    raise RuntimeError(message)
+
+
+def bench_events(server: Server):
+    # Every kind of scripted event must reach the store and move its version, or the run fails.
+    with Lnd(lnddir=server.lnddir, rpc=server.rpc) as lightning:
+        # Streams of a previous run are only dropped by the mock once it fails to write to them.
+        streams = server.streams()
+        state = ChannelState(lightning, stream=True)
+        state.start()
+        try:
+            channels = list(state.get_channels().values())
+            wait(
+                lambda: all(count > streams[path] for path, count in server.streams().items()),
+                'The event streams did not connect.'
+            )
+            channel_in, channel_out, channel_closed, channel_inactive = channels[:4]
+
+            version = state.version
+            server.event(
+                type='settle', chan_id_in=channel_in['chan_id'], chan_id_out=channel_out['chan_id'], amount=1_000
+            )
+            local_balance = str(int(channel_in['local_balance']) + 1_000)
+            wait(
+                lambda: state.get_channel(channel_in['chan_id'])['local_balance'] == local_balance,
+                'A settled HTLC did not update the balances.'
+            )
+            if state.get_channel(channel_out['chan_id'])['local_balance'] != str(
+                    int(channel_out['local_balance']) - 1_000):
+                raise RuntimeError('A settled HTLC did not update the outgoing balance.')
+
+            server.event(type='close', chan_id=channel_closed['chan_id'])
+            wait(lambda: channel_closed['chan_id'] not in state.get_channels(), 'A closed channel was kept.')
+
+            server.event(type='inactive', chan_id=channel_inactive['chan_id'])
+            wait(lambda: channel_inactive['chan_id'] not in state.get_channels(), 'An inactive channel was kept.')
+
+            chan_id = server.event(type='open', chan_id_peer=channel_in['chan_id'])['chan_id']
+            wait(lambda: chan_id in state.get_channels(), 'An opened channel was not added.')
+
+            server.event(type='active', chan_id=channel_inactive['chan_id'])
+            wait(lambda: channel_inactive['chan_id'] in state.get_channels(), 'A reactivated channel was not added.')
+            if state.version < version + 5:
+                raise RuntimeError('The store version did not move with every event.')
+        finally:
+            state.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--channels', type=int, nargs='+', default=[10, 100, 1000, 5000])
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every mock request.')
+    parser.add_argument('--bos-delay', type=float, default=0.0, help='Seconds spent by the bos stub.')
+    parser.add_argument('--port', type=int, default=18_080)
+    args = parser.parse_args()
+    environ['BENCH_BOS_DELAY'] = str(args.bos_delay)
+
+    table = Table(title='autorebalance benchmarks')
+    for column in ('Channels', 'Benchmark', 'Wall time (s)', 'REST requests', 'Peak memory (MiB)'):
+        table.add_column(column, justify='right')
+
+    for channels in args.channels:
+        with TemporaryDirectory() as directory:
+            server = Server(channels, args.latency, args.port, f'{directory}/lnd')
+            try:
+                bench_listchannels(server, f'{directory}/home')
+                benchmarks = [
+                    ('listchannels (cold)', lambda: bench_listchannels(server, mkdtemp(dir=directory))),
+                    ('listchannels (warm)', lambda: bench_listchannels(server, f'{directory}/home')),
+                    ('low outbound', lambda: bench_low_outbound(server)),
+                    ('channel events', lambda: bench_events(server)),
+                    ('cycle (lnd)', lambda: bench_cycle(server, 'lnd')),
+                    ('cycle (bos)', lambda: bench_cycle(server, BosExecutor(path=BOS)))
+                ]
+                for name, function in benchmarks:
+                    result = measure(server, function)
+                    table.add_row(
+                        f'{channels:,}', name, f'{result["time"]:.3f}', f'{result["requests"]:,}',
+                        f'{result["memory"]:.1f}'
+                    )
+            finally:
+                server.stop()
+    Console().print(table)
+
+
+if __name__ == '__main__':
+    main()
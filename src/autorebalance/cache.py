@@ -0,0 +1,73 @@
+from json import dumps, loads
+from time import time
+from threading import RLock
+from os.path import expanduser
+
+import sqlite3
+
+
+class NodeCache:
+
+    def __init__(self, path=None, ttl=86400, max_size=10_000):
+        self.path = expanduser(path) if path else ':memory:'
+        self.ttl = int(ttl)
+        self.max_size = int(max_size)
+        self.lock = RLock()
+        self.nodes = {}
+        self.aliases = {}
+
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS nodes (pub_key TEXT PRIMARY KEY, alias TEXT, info TEXT, expires REAL)'
+        )
+        self.connection.execute('DELETE FROM nodes WHERE expires < ?', (time(), ))
+        self.connection.commit()
+
+        # Warm start, every fresh entry is served from memory.
+        for pub_key, info, expires in self.connection.execute('SELECT pub_key, info, expires FROM nodes'):
+            self.index(pub_key, loads(info), expires)
+
+    def index(self, pub_key: str, node: dict, expires: float):
+        self.nodes[pub_key] = (node, expires)
+        self.aliases.setdefault(node.get('alias'), set()).add(pub_key)
+
+    def __contains__(self, pub_key: str) -> bool:
+        return self.get(pub_key) is not None
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def get(self, pub_key: str) -> dict:
+        node, expires = self.nodes.get(pub_key, (None, 0))
+        return node if expires > time() else None
+
+    def set(self, pub_key: str, node: dict, ttl=None):
+        expires = time() + (self.ttl if ttl is None else ttl)
+        with self.lock:
+            previous = self.nodes.get(pub_key)
+            if previous:
+                self.aliases.get(previous[0].get('alias'), set()).discard(pub_key)
+            self.index(pub_key, node, expires)
+            self.connection.execute(
+                'INSERT OR REPLACE INTO nodes VALUES (?, ?, ?, ?)', (pub_key, node.get('alias'), dumps(node), expires)
+            )
+            if len(self.nodes) > self.max_size:
+                self.evict(len(self.nodes) - self.max_size)
+            self.connection.commit()
+
+    def evict(self, size: int):
+        with self.lock:
+            for pub_key in sorted(self.nodes, key=lambda x: self.nodes[x][1])[:size]:
+                node, _ = self.nodes.pop(pub_key)
+                self.aliases.get(node.get('alias'), set()).discard(pub_key)
+                self.connection.execute('DELETE FROM nodes WHERE pub_key = ?', (pub_key, ))
+
+    def get_pubkeys(self, aliases: list) -> set:
+        pub_keys = set()
+        for alias in aliases:
+            pub_keys.update(self.aliases.get(alias, ()))
+        return pub_keys
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
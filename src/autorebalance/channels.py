@@ -0,0 +1,71 @@
+from array import array
+from operator import add
+
+
+class ChannelRow:
+
+    __slots__ = ('table', 'index')
+
+    def __init__(self, table: object, index: int):
+        self.table = table
+        self.index = index
+
+    def __getattr__(self, name: str):
+        return getattr(self.table, name)[self.index]
+
+    def __repr__(self):
+        return f'ChannelRow(chan_id={self.table.chan_ids[self.index]!r})'
+
+
+class ChannelTable:
+
+    def __init__(self, channels: list, policies_local: list, policies_remote: list):
+        self.chan_ids = [channel['chan_id'] for channel in channels]
+        self.remote_pubkeys = [channel['remote_pubkey'] for channel in channels]
+        self.indexes = {chan_id: index for index, chan_id in enumerate(self.chan_ids)}
+
+        self.capacity = self.column(channels, 'capacity')
+        self.local_balance = self.column(channels, 'local_balance')
+        self.remote_balance = self.column(channels, 'remote_balance')
+        self.local_reserve = self.column(channels, 'local_chan_reserve_sat')
+        self.remote_reserve = self.column(channels, 'remote_chan_reserve_sat')
+
+        self.local_fee_rate = self.column(policies_local, 'fee_rate_milli_msat')
+        self.local_fee_base = self.column(policies_local, 'fee_base_msat')
+        self.remote_fee_rate = self.column(policies_remote, 'fee_rate_milli_msat')
+        self.remote_fee_base = self.column(policies_remote, 'fee_base_msat')
+
+        self.local_available = array('q', (max(0, x - y) for x, y in zip(self.local_balance, self.local_reserve)))
+        self.remote_available = array('q', (max(0, x - y) for x, y in zip(self.remote_balance, self.remote_reserve)))
+        self.capacity_available = array('q', map(add, self.local_available, self.remote_available))
+
+        self.local_ratio = self.ratio(self.local_available, 10, int)
+        self.remote_ratio = array('q', (10 - x for x in self.local_ratio))
+        self.local_available_percentage = self.ratio(self.local_available, 100, round)
+        self.remote_available_percentage = self.ratio(self.remote_available, 100, round)
+
+    @staticmethod
+    def column(rows: list, key: str) -> array:
+        return array('q', (int((row or {}).get(key, 0)) for row in rows))
+
+    def ratio(self, column: array, scale: int, rounding: object) -> array:
+        return array('q', (
+            rounding(scale * x / y) if y else 0 for x, y in zip(column, self.capacity_available)
+        ))
+
+    def __len__(self):
+        return len(self.chan_ids)
+
+    def __getitem__(self, index: int) -> ChannelRow:
+        return ChannelRow(self, index)
+
+    def row(self, chan_id: int) -> ChannelRow:
+        return ChannelRow(self, self.indexes[chan_id])
+
+    def get_low_outbound(self, indexes: list) -> list:
+        indexes = [index for index in indexes if self.local_ratio[index] < self.remote_ratio[index]]
+        return sorted(indexes, key=self.local_available.__getitem__)
+
+    def get_high_outbound(self, indexes: list) -> list:
+        indexes = [index for index in indexes if self.local_ratio[index] > self.remote_ratio[index]]
+        return sorted(indexes, key=self.remote_available.__getitem__, reverse=True)
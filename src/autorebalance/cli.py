@@ -1,15 +1,81 @@
+from csv import DictWriter
+from json import dumps
 from time import time
-from rich import box
-from .rebalance import Rebalance, Lnd
-
-from rich.live import Live
-from rich.table import Table
-from rich.syntax import Syntax
-from rich.console import Console
+from signal import signal, SIGINT, SIGTERM
+from pathlib import Path
+from functools import lru_cache
+from threading import Event, Lock
+from os.path import expanduser
+from concurrent.futures import ThreadPoolExecutor
+from .metrics import Metrics
 
 import click
 
-console = Console()
+# rich, requests and yaml are imported by the commands using them, --help and the
+# machine-readable listchannels output do not pay for them.
+
+CONFIG_PATH = '~/.autorebalance/config.yaml'
+
+@lru_cache(maxsize=None)
+def get_console() -> object:
+    from rich.console import Console
+
+    return Console()
+
+def read_config() -> dict:
+    from yaml import safe_load
+
+    path = Path(expanduser(CONFIG_PATH))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if not path.exists():
+        path.touch()
+
+    config = safe_load(path.open())
+    return config if config else {}
+
+def create_lnd(config: dict, metrics: Metrics, cache_path='~/.autorebalance/cache.db') -> object:
+    from .cache import NodeCache
+    from .rebalance import Lnd
+
+    # Recorded runs start from an empty node cache, every lookup goes through the recording.
+    if config.get('tape'):
+        cache_path = None
+
+    return Lnd(
+        lnddir=config['lnddir'],
+        rpc=config['rpc'],
+        network=config['network'],
+        pool_size=config.get('pool_size', 10),
+        connect_timeout=config.get('connect_timeout', 5),
+        read_timeout=config.get('read_timeout', 60),
+        retries=config.get('retries', 3),
+        concurrency=config.get('concurrency', 8),
+        cache=NodeCache(
+            path=cache_path,
+            ttl=config.get('cache_ttl', 86400),
+            max_size=config.get('cache_size', 10_000)
+        ),
+        metrics=metrics,
+        recorder=config.get('tape')
+    )
+
+def get_lnd(ctx: object) -> object:
+    ctx = ctx.find_root()
+    if not ctx.obj.get('lnd'):
+        ctx.obj['lnd'] = create_lnd(ctx.obj, ctx.obj['metrics'])
+        ctx.call_on_close(ctx.obj['lnd'].close)
+    return ctx.obj['lnd']
+
+def get_nodes(config: dict) -> list:
+    # Every profile under nodes inherits the top level keys it does not set.
+    defaults = {key: value for key, value in config.items() if key not in ('nodes', 'lnd', 'metrics', 'tape')}
+    nodes = []
+    for index, profile in enumerate(config.get('nodes') or []):
+        node = dict(defaults, **profile)
+        node['name'] = str(profile.get('name') or profile.get('rpc') or f'node{index}')
+        node['lnddir'] = expanduser(node['lnddir'])
+        nodes.append(node)
+    return nodes
 
 @click.group()
 @click.option(
@@ -24,19 +90,24 @@ console = Console()
     '--network', '-n', default='mainnet', show_default=True,
     help='Say which network lnd is using.'
 )
+@click.option(
+    '--profile', is_flag=True, help='Print where the time was spent at the end of the run.'
+)
+@click.option(
+    '--record', type=click.Path(dir_okay=False), help='Save every LND response and bos output to this file.'
+)
+@click.option(
+    '--replay', type=click.Path(exists=True, dir_okay=False),
+    help='Run from a file saved with --record, without LND and bos.'
+)
 @click.pass_context
-def cli(ctx: object, lnddir: str, rpc: str, network: str):
-    from yaml import safe_load
-    from pathlib import Path
-    from os.path import expanduser
-
-    path = Path(expanduser('~/.autorebalance/config.yaml'))
-    path.parent.mkdir(parents=True, exist_ok=True)
-    path.touch(exist_ok=True)
+def cli(ctx: object, lnddir: str, rpc: str, network: str, profile: bool, record: str, replay: str):
+    from .recorder import Recorder, Replayer
 
     ctx.ensure_object(dict)
-    config = safe_load(path.open())
-    config = config if config else {}
+    if record and replay:
+        raise click.UsageError('--record and --replay cannot be used together.')
+    config = read_config()
 
     if config.get('lnddir') and lnddir == '~/.lnd':
         lnddir = config.get('lnddir')
@@ -52,13 +123,121 @@ def cli(ctx: object, lnddir: str, rpc: str, network: str):
 
     lnddir = expanduser(lnddir)
     ctx.obj.update(config)
-    ctx.obj.update({'lnddir': lnddir, 'rpc': rpc, 'network': network})
+    ctx.obj.update({'lnddir': lnddir, 'rpc': rpc, 'network': network, 'metrics': Metrics()})
+    ctx.obj['tape'] = Recorder(record) if record else Replayer(replay) if replay else None
+
+    def close():
+        if ctx.obj['tape']:
+            ctx.obj['tape'].close()
+        export_metrics(ctx.obj, ctx.obj['metrics'])
+        if profile:
+            print_profile(ctx.obj['metrics'])
+    ctx.call_on_close(close)
+
+
+def export_metrics(config: dict, metrics: Metrics):
+    from rich.console import Console
+
+    # The work is done by then, an unwritable path is reported without failing the command.
+    for key, export in (('metrics_textfile', metrics.export_prometheus), ('metrics_jsonl', metrics.export_jsonl)):
+        if config.get(key):
+            try:
+                export(config.get(key))
+            except OSError as error:
+                Console(stderr=True).print(f'[bright_yellow]Unable to write {key}: {error}[/bright_yellow]')
+
+
+def print_profile(metrics: Metrics):
+    from rich import box
+    from rich.table import Table
+    from rich.console import Console
+
+    table = Table(box=box.SIMPLE, title='Profile')
+    table.add_column('Metric')
+    table.add_column('Count', justify='right')
+    table.add_column('Total (s)', justify='right')
+    table.add_column('Mean (ms)', justify='right')
+    table.add_column('p95 (ms)', justify='right')
+    table.add_column('Max (ms)', justify='right')
+
+    for row in metrics.summary():
+        name = ' '.join([row['name']] + [f'{name}={value}' for name, value in row['labels'].items()])
+        if 'total' in row:
+            table.add_row(
+                name,
+                f'{row["count"]:,}',
+                f'{row["total"]:.3f}',
+                f'{row["mean"] * 1000:.1f}',
+                f'{row["p95"] * 1000:.1f}',
+                f'{row["max"] * 1000:.1f}'
+            )
+        else:
+            table.add_row(name, f'{row["count"]:,}')
+    if table.rows:
+        # stderr keeps the json and csv output of listchannels parseable.
+        Console(stderr=True).print(table)
+
+
+FIELDS = (
+    'chan_id', 'alias', 'remote_pubkey', 'capacity', 'local_available', 'remote_available',
+    'local_available_percentage', 'remote_available_percentage', 'local_fee_base', 'local_fee_rate',
+    'remote_fee_base', 'remote_fee_rate'
+)
+
+def stream_channels(ctx: object, output: str):
+    from .channels import ChannelTable
+    from .rebalance import Rebalance
+
+    lightning = get_lnd(ctx)
+    rebalance = Rebalance(
+        lnd=lightning, excluded=ctx.obj.get('excluded', []), snapshot_ttl=ctx.obj.get('snapshot_ttl', 60)
+    )
+    snapshot = rebalance.snapshot
+    channels = list(snapshot.state.get_channels().values())
+
+    stdout = click.get_text_stream('stdout')
+    writer = DictWriter(stdout, fieldnames=FIELDS, lineterminator='\n')
+    if output == 'csv':
+        writer.writeheader()
+
+    def get_row(channel: dict) -> tuple:
+        alias = lightning.get_node_alias(channel['remote_pubkey'])
+        edge = lightning.get_channel_info(channel['chan_id'])
+        table = ChannelTable(
+            [channel], [snapshot.get_policy(edge, local=True)], [snapshot.get_policy(edge, local=False)]
+        )
+        return alias, table[0]
+
+    # Aliases and policies are fetched concurrently, each row is written as soon as its own are known.
+    with ThreadPoolExecutor(max_workers=lightning.aio.concurrency) as executor:
+        for channel, (alias, row) in zip(channels, executor.map(get_row, channels)):
+            if rebalance.ignore_channel_excluded(channel):
+                continue
+
+            record = {'chan_id': channel['chan_id'], 'alias': alias, 'remote_pubkey': channel['remote_pubkey']}
+            record.update({field: getattr(row, field) for field in FIELDS[3:]})
+            if output == 'json':
+                stdout.write(dumps(record) + '\n')
+            else:
+                writer.writerow(record)
+            stdout.flush()
 
 
 @cli.command()
+@click.option(
+    '--format', 'output', default='table', show_default=True, type=click.Choice(['table', 'json', 'csv']),
+    help='json and csv write one line per channel without rendering a table.'
+)
 @click.pass_context
-def listchannels(ctx: object):
+def listchannels(ctx: object, output: str):
     """List all channels."""
+    if output != 'table':
+        return stream_channels(ctx, output)
+
+    from rich import box
+    from rich.table import Table
+    from .rebalance import Rebalance
+
     table = Table(box=box.SIMPLE)
     table.add_column('\nInbound', justify='right', style='bright_red')
     table.add_column('\nRatio', justify='center', style='bright_red')
@@ -69,30 +248,28 @@ def listchannels(ctx: object):
     table.add_column('Remote\nFee Rate\n(ppm)', justify='center', style='bright_yellow')
     table.add_column('\nAlias', max_width=25, no_wrap=True)
 
-    lightning = Lnd(
-        lnddir=ctx.obj['lnddir'], rpc=ctx.obj['rpc'], network=ctx.obj['network']
-    )
+    lightning = get_lnd(ctx)
     rebalance = Rebalance(
-        lnd=lightning, excluded=ctx.obj.get('excluded', [])
+        lnd=lightning, excluded=ctx.obj.get('excluded', []), snapshot_ttl=ctx.obj.get('snapshot_ttl', 60)
     )
     for channel in rebalance.get_list_channels():
         alias = lightning.get_node_alias(channel['remote_pubkey'])
-        ratio = rebalance.get_ratio_channel(channel)
+        row = rebalance.snapshot.get_table().row(channel['chan_id'])
         ratio = (
                 '[bright_red]'
-                + ('·' * ratio['remote'])
+                + ('·' * row.remote_ratio)
                 + '[/bright_red]'
                 + '|' + '[green]'
-                + ('·' * ratio['local'])
+                + ('·' * row.local_ratio)
                 + '[/green]'
         )
-        local_available = rebalance.get_local_available(channel)
-        local_base_fee = lightning.get_fee_base_local(channel['chan_id'])
-        local_fee_rate = lightning.get_fee_rate_local(channel['chan_id'])
+        local_available = row.local_available
+        local_base_fee = row.local_fee_base
+        local_fee_rate = row.local_fee_rate
 
-        remote_available = rebalance.get_remote_available(channel)
-        remote_base_fee = lightning.get_fee_base_remote(channel['chan_id'])
-        remote_fee_rate = lightning.get_fee_rate_remote(channel['chan_id'])
+        remote_available = row.remote_available
+        remote_base_fee = row.remote_fee_base
+        remote_fee_rate = row.remote_fee_rate
 
         table.add_row(
             f'{remote_available:,}',
@@ -105,87 +282,140 @@ def listchannels(ctx: object):
             alias
         )
     if table.rows:
-        console.print(table)
+        get_console().print(table)
+
+
+def rebalance_options(function: object) -> object:
+    options = [
+        click.option(
+            '--amount', '-a', default=50_000, help='Enter the rebalancing amount.'
+        ),
+        click.option(
+            '--timeout', '-t', default=300, show_default=True, help='Specify a timeout'
+        ),
+        click.option(
+            '--fee-limit', '-f', default=0, show_default=True, help='Specify a fee limit on sats.'
+        ),
+        click.option(
+            '--fee-ppm-limit', default=0, show_default=True, help='Specify a fee rate limit on sats.'
+        ),
+        click.option(
+            '--max-total-fees', default=5_000, show_default=True, help='Specify a total accumulated fees.'
+        ),
+        click.option(
+            '--excluded', multiple=True, show_default=True, help='Specify channels that should be ignored.'
+        ),
+        click.option(
+            '--expressions', multiple=True, show_default=True,
+            help='Specify expressions that will be used to determine whether a channel continues to be rebalanced or not.'
+        ),
+        click.option(
+            '--limit-rebalance', default=1, show_default=True, help='Limits the rebalancing amount.'
+        ),
+        click.option(
+            '--node-save', help='Node to use for rebalance.'
+        ),
+        click.option(
+            '--parallel', default=1, show_default=True, help='Number of rebalances executed at the same time.'
+        ),
+        click.option(
+            '--adaptive', is_flag=True,
+            help='Size every attempt from the channel deficit, halve it on failure and grow it after a success.'
+        ),
+        click.option(
+            '--max-amount', default=0, help='Largest adaptive amount, unlimited when 0.'
+        ),
+        click.option(
+            '--executor', default='lnd', show_default=True, type=click.Choice(['lnd', 'bos']),
+            help='Pay circular routes directly through LND or with bos.'
+        )
+    ]
+    for option in reversed(options):
+        function = option(function)
+    return function
 
 
-@cli.command('rebalance')
-@click.option(
-    '--amount', '-a', default=50_000, help='Enter the rebalancing amount.'
-)
-@click.option(
-    '--timeout', '-t', default=300, show_default=True, help='Specify a timeout'
-)
-@click.option(
-    '--fee-limit', '-f', default=0, show_default=True, help='Specify a fee limit on sats.'
-)
-@click.option(
-    '--fee-ppm-limit', default=0, show_default=True, help='Specify a fee rate limit on sats.'
-)
-@click.option(
-    '--max-total-fees', default=5_000, show_default=True, help='Specify a total accumulated fees.'
-)
-@click.option(
-    '--excluded', multiple=True, show_default=True, help='Specify channels that should be ignored.'
-)
-@click.option(
-    '--expressions', multiple=True, show_default=True,
-    help='Specify expressions that will be used to determine whether a channel continues to be rebalanced or not.'
-)
-@click.option(
-    '--limit-rebalance', default=1, show_default=True, help='Limits the rebalancing amount.'
-)
-@click.option(
-    '--node-save', help='Node to use for rebalance.'
-)
-@click.pass_context
-def rebalance_channels(ctx: object, **kwargs: dict):
-    """Rebalance unbalanced channels."""
-    if ctx.obj.get('amount') and int(kwargs.get('amount')) == 50_000:
-        kwargs['amount'] = ctx.obj.get('amount')
+def get_options(config: dict, kwargs: dict) -> dict:
+    kwargs = dict(kwargs)
+    if config.get('amount') and int(kwargs.get('amount')) == 50_000:
+        kwargs['amount'] = config.get('amount')
 
-    if ctx.obj.get('timeout') and (kwargs.get('timeout') == 300):
-        kwargs['timeout'] = ctx.obj.get('timeout')
+    if config.get('timeout') and (kwargs.get('timeout') == 300):
+        kwargs['timeout'] = config.get('timeout')
 
-    if ctx.obj.get('fee_limit') and (not kwargs.get('fee_limit')):
-        kwargs['fee_limit'] = ctx.obj.get('fee_limit')
+    if config.get('fee_limit') and (not kwargs.get('fee_limit')):
+        kwargs['fee_limit'] = config.get('fee_limit')
 
-    if ctx.obj.get('fee_ppm_limit') and (not kwargs.get('fee_ppm_limit')):
-        kwargs['fee_ppm_limit'] = ctx.obj.get('fee_ppm_limit')
+    if config.get('fee_ppm_limit') and (not kwargs.get('fee_ppm_limit')):
+        kwargs['fee_ppm_limit'] = config.get('fee_ppm_limit')
 
-    if ctx.obj.get('max_total_fees') and (kwargs.get('max_total_fees') == 5_000):
-        kwargs['max_total_fees'] = ctx.obj.get('max_total_fees')
+    if config.get('max_total_fees') and (kwargs.get('max_total_fees') == 5_000):
+        kwargs['max_total_fees'] = config.get('max_total_fees')
 
-    if ctx.obj.get('excluded') and (not kwargs.get('excluded')):
-        kwargs['excluded'] = ctx.obj.get('excluded')
+    if config.get('excluded') and (not kwargs.get('excluded')):
+        kwargs['excluded'] = config.get('excluded')
 
-    if ctx.obj.get('expressions') and (not kwargs.get('expressions')):
-        kwargs['expressions'] = ctx.obj.get('expressions')
+    if config.get('expressions') and (not kwargs.get('expressions')):
+        kwargs['expressions'] = config.get('expressions')
 
-    if ctx.obj.get('limit_rebalance') and kwargs.get('limit_rebalance') == 1:
-        kwargs['limit_rebalance'] = ctx.obj.get('limit_rebalance')
+    if config.get('limit_rebalance') and kwargs.get('limit_rebalance') == 1:
+        kwargs['limit_rebalance'] = config.get('limit_rebalance')
 
-    if ctx.obj.get('node_save') and (not kwargs.get('node_save')):
-        kwargs['node_save'] = ctx.obj.get('node_save')
+    if config.get('node_save') and (not kwargs.get('node_save')):
+        kwargs['node_save'] = config.get('node_save')
 
-    lightning = Lnd(
-        lnddir=ctx.obj['lnddir'], rpc=ctx.obj['rpc'], network=ctx.obj['network']
-    )
-    if not kwargs.get('fee_limit') and not kwargs.get('fee_ppm_limit'):
-        console.print('[bright_yellow]You have not set --fee-limit or --fee-ppm-limit![/bright_yellow]')
-        raise click.Abort()
+    if config.get('parallel') and kwargs.get('parallel') == 1:
+        kwargs['parallel'] = config.get('parallel')
 
-    if int(kwargs.get('amount')) < 50_000:
-        console.print('[bright_yellow]Amount must be greater than 50K sats.[/bright_yellow]')
-        raise click.Abort()
+    if config.get('adaptive') and not kwargs.get('adaptive'):
+        kwargs['adaptive'] = config.get('adaptive')
 
-    table = Table(box=box.SIMPLE)
-    table.add_column('Rebalance (Amount)', justify='center', style='#26a99f')
-    table.add_column('Rebalance (Fees)', justify='center', style='bright_yellow')
-    table.add_column('Channel (Out)', justify='center', style='bright_red')
-    table.add_column('Channel (Route)', justify='center', style='#326d5e')
-    table.add_column('Channel (In)', justify='center', style='bright_green')
+    if config.get('max_amount') and not kwargs.get('max_amount'):
+        kwargs['max_amount'] = config.get('max_amount')
 
-    rebalance = Rebalance(
+    if config.get('executor') and kwargs.get('executor') == 'lnd':
+        kwargs['executor'] = config.get('executor')
+
+    if not kwargs.get('fee_limit') and not kwargs.get('fee_ppm_limit'):
+        raise ValueError('You have not set --fee-limit or --fee-ppm-limit!')
+
+    if int(kwargs.get('amount')) < 50_000:
+        raise ValueError('Amount must be greater than 50K sats.')
+
+    if kwargs.get('max_amount') and int(kwargs.get('max_amount')) < int(kwargs.get('amount')):
+        raise ValueError('Max amount must not be lower than the amount.')
+
+    if int(kwargs.get('parallel')) < 1:
+        raise ValueError('Parallel must be at least 1.')
+    return kwargs
+
+
+def get_rebalance(
+        lightning: object, config: dict, kwargs: dict, history_path='~/.autorebalance/history.db') -> object:
+    from .graph import Graph
+    from .history import History
+    from .rebalance import Rebalance
+
+    if kwargs.get('node_save') and kwargs.get('executor') == 'lnd':
+        get_console().print('[bright_yellow]node_save is only used by the bos executor, it is ignored.[/bright_yellow]')
+
+    graph = None
+    if config.get('graph_file'):
+        try:
+            graph = Graph.from_file(config.get('graph_file'))
+        except (OSError, EOFError, ValueError, KeyError) as error:
+            raise ValueError(f'Unable to load graph_file {config.get("graph_file")}: {error}')
+    elif config.get('graph_filter'):
+        graph = Graph.from_lnd(lightning)
+
+    history = History(path=history_path, half_life=config.get('history_half_life', 86400))
+    if config.get('tape'):
+        if config.get('tape').replay:
+            history.close()
+            history = History(half_life=config.get('history_half_life', 86400))
+        config.get('tape').sync_history(history)
+
+    return Rebalance(
         lnd=lightning,
         amount=kwargs.get('amount'),
         timeout=kwargs.get('timeout'),
@@ -195,45 +425,168 @@ def rebalance_channels(ctx: object, **kwargs: dict):
         fee_limit_percent=kwargs.get('fee_ppm_limit'),
         excluded=kwargs.get('excluded'),
         expressions=kwargs.get('expressions'),
-        limit_rebalance=kwargs.get('limit_rebalance')
+        limit_rebalance=kwargs.get('limit_rebalance'),
+        snapshot_ttl=config.get('snapshot_ttl', 60),
+        stream=config.get('stream_events', False) and not config.get('tape'),
+        executor=kwargs.get('executor'),
+        adaptive=kwargs.get('adaptive', False),
+        max_amount=kwargs.get('max_amount', 0),
+        graph=graph,
+        history=history
     )
-    
+
+
+def get_route(rebalance: dict) -> tuple:
+    hops = rebalance['hops']
+    return hops[0]['alias'], hops[int(len(hops) / 2)]['alias'], hops[-1]['alias']
+
+
+def rebalance_nodes(ctx: object, kwargs: dict):
+    from rich import box
+    from rich.live import Live
+    from rich.table import Table
+
+    if ctx.obj.get('tape'):
+        get_console().print('[bright_yellow]--record and --replay handle a single node.[/bright_yellow]')
+        raise click.Abort()
+
+    nodes = get_nodes(ctx.obj)
+    if not nodes:
+        get_console().print('[bright_yellow]No nodes have been set in config.yaml.[/bright_yellow]')
+        raise click.Abort()
+
+    options = {}
+    for node in nodes:
+        try:
+            options[node['name']] = get_options(node, kwargs)
+        except ValueError as error:
+            get_console().print(f'[bright_yellow]{node["name"]}: {error}[/bright_yellow]')
+            raise click.Abort()
+
+    table = Table(box=box.SIMPLE)
+    table.add_column('Node', justify='center')
+    table.add_column('Rebalance (Amount)', justify='center', style='#26a99f')
+    table.add_column('Rebalance (Fees)', justify='center', style='bright_yellow')
+    table.add_column('Channel (Out)', justify='center', style='bright_red')
+    table.add_column('Channel (Route)', justify='center', style='#326d5e')
+    table.add_column('Channel (In)', justify='center', style='bright_green')
+
+    lock = Lock()
+
+    def rebalance_node(node: dict) -> tuple:
+        # Nodes share nothing but the metrics, each one has its own client, cache, history and budget.
+        name = node['name']
+        path = Path(expanduser(f'~/.autorebalance/nodes/{name.replace("/", "_")}'))
+        path.mkdir(parents=True, exist_ok=True)
+
+        def add_row(rebalance_channel: dict, rebalanced_fees: int):
+            rebalanced_hop_out, rebalanced_hop_route, rebalanced_hop_in = get_route(rebalance_channel)
+            with lock:
+                table.add_row(
+                    name,
+                    f'{rebalance_channel["amount"]:,}',
+                    f'{rebalanced_fees:,}',
+                    str(rebalanced_hop_out),
+                    str(rebalanced_hop_route),
+                    str(rebalanced_hop_in)
+                )
+                live.update(table)
+
+        try:
+            with create_lnd(node, ctx.obj['metrics'], cache_path=str(path / 'cache.db')) as lightning:
+                rebalance = get_rebalance(lightning, node, options[name], history_path=str(path / 'history.db'))
+                try:
+                    rebalance.run(parallel=options[name].get('parallel'), callback=add_row)
+                finally:
+                    rebalance.snapshot.state.stop()
+                    rebalance.history.close()
+                return name, rebalance.total_rebalance_amount, rebalance.total_rebalance_fees, None
+        except Exception as error:
+            return name, 0, 0, str(error) or type(error).__name__
+
+    with Live(table, refresh_per_second=4) as live:
+        with ThreadPoolExecutor(max_workers=len(nodes)) as executor:
+            results = list(executor.map(rebalance_node, nodes))
+
+        total_amount = sum(result[1] for result in results)
+        total_fees = sum(result[2] for result in results)
+        table.add_row(
+            '',
+            '─' * (len(f'{total_amount:,}') + 2),
+            '─' * (len(f'{total_fees:,}') + 2),
+            )
+        for name, amount, fees, error in results:
+            table.add_row(name, f'{amount:,}', f'{fees:,}', f'[bright_yellow]{error}[/bright_yellow]' if error else '')
+        table.add_row('', f'{total_amount:,}', f'{total_fees:,}')
+        live.update(table)
+
+    if not total_amount:
+        get_console().print('[bright_yellow]No channels have been rebalanced.[/bright_yellow]')
+        raise click.Abort()
+
+
+@cli.command('rebalance')
+@rebalance_options
+@click.option(
+    '--all-nodes', is_flag=True, help='Rebalance every node listed under nodes in config.yaml concurrently.'
+)
+@click.pass_context
+def rebalance_channels(ctx: object, all_nodes: bool, **kwargs: dict):
+    """Rebalance unbalanced channels."""
+    from rich import box
+    from rich.live import Live
+    from rich.text import Text
+    from rich.table import Table
+    from rich.console import Group
+
+    if all_nodes:
+        return rebalance_nodes(ctx, kwargs)
+
+    try:
+        kwargs = get_options(ctx.obj, kwargs)
+        rebalance = get_rebalance(get_lnd(ctx), ctx.obj, kwargs)
+    except ValueError as error:
+        get_console().print(f'[bright_yellow]{error}[/bright_yellow]')
+        raise click.Abort()
+    ctx.call_on_close(rebalance.snapshot.state.stop)
+    ctx.call_on_close(rebalance.history.close)
+
+    table = Table(box=box.SIMPLE)
+    table.add_column('Rebalance (Amount)', justify='center', style='#26a99f')
+    table.add_column('Rebalance (Fees)', justify='center', style='bright_yellow')
+    table.add_column('Channel (Out)', justify='center', style='bright_red')
+    table.add_column('Channel (Route)', justify='center', style='#326d5e')
+    table.add_column('Channel (In)', justify='center', style='bright_green')
+
+    lock = Lock()
+    progress = {}
+
+    def render() -> Group:
+        return Group(table, *[Text(message, style='bright_black') for message in progress.values()])
+
+    def add_row(rebalance_channel: dict, rebalanced_fees: int):
+        rebalanced_hop_out, rebalanced_hop_route, rebalanced_hop_in = get_route(rebalance_channel)
+        with lock:
+            table.add_row(
+                f'{rebalance_channel["amount"]:,}',
+                f'{rebalanced_fees:,}',
+                str(rebalanced_hop_out),
+                str(rebalanced_hop_route),
+                str(rebalanced_hop_in)
+            )
+            live.update(render())
+
+    def add_progress(channel: dict, message: str):
+        with lock:
+            if message:
+                progress[channel['chan_id']] = message
+            else:
+                progress.pop(channel['chan_id'], None)
+            live.update(render())
+
     with Live(table, refresh_per_second=4) as live:
-        for channel_low_outbound in rebalance.get_list_channels_low_outbound():
-            while int(time() - rebalance.timestamp) < rebalance.timeout:
-                if not rebalance.parser_expr(rebalance.lnd.filter_list_channel(channel_low_outbound['chan_id'])[0]):
-                    break 
-                if rebalance.total_rebalance_fees >= rebalance.max_total_fees:
-                    break
-                if rebalance.total_rebalance_channels >= rebalance.limit_rebalance:
-                    break
-                
-                rebalance_channel = rebalance.exec_rebalance(channel_low_outbound)
-                if rebalance_channel['error']:
-                    break
-                else:
-                    rebalanced_fees = int(float(rebalance_channel['rebalance']['rebalance_fees_spent']) * pow(10, 8))
-                    rebalanced_hop_in = rebalance_channel['hops'][-1]['alias']
-                    rebalanced_hop_out = rebalance_channel['hops'][0]['alias']
-
-                    rebalanced_hop_route = rebalance_channel['hops']
-                    rebalanced_hop_route = rebalanced_hop_route[
-                        int(len(rebalanced_hop_route) / 2)
-                    ]['alias']
-
-                    rebalance.total_rebalance_fees += rebalanced_fees
-                    rebalance.total_rebalance_amount += rebalance.amount
-                    rebalance.total_rebalance_channels += 1
-
-                    table.add_row(
-                        f'{int(kwargs["amount"]):,}',
-                        f'{rebalanced_fees:,}',
-                        str(rebalanced_hop_out),
-                        str(rebalanced_hop_route),
-                        str(rebalanced_hop_in)
-                    )
-                    live.update(table)
-        
+        rebalance.run(parallel=kwargs.get('parallel'), callback=add_row, progress=add_progress)
+
         if table.rows:
             table.add_row(
                 '─' * (len(f'{rebalance.total_rebalance_amount:,}') + 2),
@@ -245,5 +598,114 @@ def rebalance_channels(ctx: object, **kwargs: dict):
             )
             live.update(table)
         else:
-            console.print('[bright_yellow]No channels have been rebalanced.[/bright_yellow]')
+            get_console().print('[bright_yellow]No channels have been rebalanced.[/bright_yellow]')
             raise click.Abort()
+
+
+@cli.command()
+@rebalance_options
+@click.option(
+    '--interval', default=3600, show_default=True, help='Seconds between two rebalance cycles.'
+)
+@click.option(
+    '--check-interval', default=60, show_default=True, help='Seconds between two checks of config and channels.'
+)
+@click.option(
+    '--trigger', is_flag=True, help='Start a cycle as soon as the channels to rebalance or their balances change.'
+)
+@click.option(
+    '--min-interval', default=600, show_default=True, help='Minimum seconds between two cycles started by --trigger.'
+)
+@click.pass_context
+def daemon(ctx: object, interval: int, check_interval: int, trigger: bool, min_interval: int, **kwargs: dict):
+    """Rebalance channels periodically."""
+    console = get_console()
+    lightning = get_lnd(ctx)
+    stopped = Event()
+    state = {'rebalance': None, 'mtime': None, 'timestamp': 0, 'window': 0, 'planned': None}
+
+    def stop(*args):
+        # The attempts in flight are finished, no new attempt is started.
+        stopped.set()
+        if state['rebalance']:
+            state['rebalance'].stop()
+
+    signal(SIGTERM, stop)
+    signal(SIGINT, stop)
+
+    def close():
+        if state['rebalance']:
+            state['rebalance'].snapshot.state.stop()
+            state['rebalance'].history.close()
+
+    def log_row(rebalance_channel: dict, rebalanced_fees: int):
+        rebalanced_hop_out, rebalanced_hop_route, rebalanced_hop_in = get_route(rebalance_channel)
+        console.log(
+            f'Rebalanced {rebalance_channel["amount"]:,} sats for {rebalanced_fees:,} sats fees: '
+            f'{rebalanced_hop_out} -> {rebalanced_hop_route} -> {rebalanced_hop_in}'
+        )
+
+    def get_planned(rebalance: object) -> tuple:
+        # A trigger only fires when the planned channels or their balances moved since the last cycle.
+        return tuple(sorted(
+            (channel['chan_id'], channel['local_balance']) for channel in rebalance.get_list_channels_planned()
+        ))
+
+    ctx.call_on_close(close)
+    path = Path(expanduser(CONFIG_PATH))
+    while not stopped.is_set():
+        mtime = path.stat().st_mtime if path.exists() else None
+        if mtime != state['mtime']:
+            config = dict(
+                read_config(), lnddir=ctx.obj['lnddir'], rpc=ctx.obj['rpc'], network=ctx.obj['network'],
+                tape=ctx.obj['tape']
+            )
+            try:
+                options = get_options(config, kwargs)
+                rebalance = get_rebalance(lightning, config, options)
+            except ValueError as error:
+                console.log(f'[bright_yellow]{error}[/bright_yellow]')
+                if not state['rebalance']:
+                    raise click.Abort()
+            else:
+                close()
+                state.update({'rebalance': rebalance, 'options': options})
+                console.log('Configuration loaded.')
+            state['mtime'] = mtime
+
+        rebalance = state['rebalance']
+        try:
+            # max_total_fees and limit_rebalance are renewed once per interval, triggered cycles share them.
+            budget = (time() - state['window']) >= interval
+            due = budget
+            if not due and trigger and (time() - state['timestamp']) >= min_interval:
+                planned = get_planned(rebalance)
+                due = bool(planned) and planned != state['planned']
+
+            if due:
+                rebalance.reset(budget=budget)
+                channels, amount, fees = (
+                    rebalance.total_rebalance_channels,
+                    rebalance.total_rebalance_amount,
+                    rebalance.total_rebalance_fees
+                )
+                try:
+                    rebalance.run(parallel=state['options'].get('parallel'), callback=log_row)
+                finally:
+                    # A failed cycle waits for the interval too, it may have spent part of its budget.
+                    state['timestamp'] = time()
+                    if budget:
+                        state['window'] = state['timestamp']
+                if trigger:
+                    state['planned'] = get_planned(rebalance)
+                console.log(
+                    f'Cycle finished, {rebalance.total_rebalance_channels - channels} rebalances, '
+                    f'{rebalance.total_rebalance_amount - amount:,} sats for '
+                    f'{rebalance.total_rebalance_fees - fees:,} sats fees.'
+                )
+                export_metrics(config, lightning.metrics)
+        except Exception as error:
+            # A failed cycle is logged, the next one starts from a clean state.
+            console.log(f'[bright_yellow]Cycle failed: {str(error) or type(error).__name__}[/bright_yellow]')
+        stopped.wait(check_interval)
+    console.log('Daemon stopped.')
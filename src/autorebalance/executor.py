@@ -0,0 +1,232 @@
+from re import compile as compile_regex
+from os import killpg
+from time import time
+from signal import SIGTERM
+from base64 import urlsafe_b64encode
+from os.path import exists
+from threading import Event, Timer
+from functools import partial
+from contextlib import closing
+from subprocess import Popen, PIPE, STDOUT
+
+# bos reports failures as `err: ...` or as a [code, "Message"] array, on one line or pretty printed.
+FAILURE = compile_regex(r'^(err:|\[\s*[45]\d\d\s*,)')
+FAILURE_CODE = compile_regex(r'^[45]\d\d\s*,')
+
+
+class Executor:
+
+    def execute(self, rebalance: object, channel_out: dict, channel_in: dict, amount: int) -> dict:
+        raise NotImplementedError
+
+
+class BosParser:
+    # Incremental Rebalance.parser_rebalance, bos output is fed one line at a time.
+
+    def __init__(self):
+        self.section = ''
+        self.failed = False
+        self.array = False
+        self.result = {'error': False, 'hops': [], 'rebalance': {}}
+
+    def feed(self, line: str) -> bool:
+        # Aliases may contain "err" (Cherry, Strawberry), only a real failure line ends the attempt.
+        stripped = line.strip()
+        if FAILURE.match(stripped) or (self.array and FAILURE_CODE.match(stripped)):
+            self.failed = True
+            return False
+        self.array = stripped == '['
+
+        x = line.strip().replace(':', '').replace('-', '')
+        if 'evaluating' != self.section and 'evaluating' == x:
+            self.section = 'evaluating'
+        elif 'rebalance' != self.section and 'rebalance' == x:
+            self.section = 'rebalance'
+        else:
+            z = x.split()
+            if len(z) == 6 and self.section == 'evaluating':
+                self.result['hops'].append({'alias': z[0], 'pubkey': z[1][:-1]})
+            elif len(z) == 2 and self.section == 'rebalance':
+                self.result['rebalance'].update({z[0]: z[1]})
+            elif len(z) == 3 and self.section == 'rebalance':
+                self.result['rebalance'].update({z[0]: z[2][1:-1]})
+            else:
+                if len(z) == 3:
+                    self.result[z[0]] = {'alias': z[1], 'pubkey': z[2]}
+                if len(z) == 2:
+                    self.result[z[0]] = z[1]
+        return True
+
+    def get_result(self) -> dict:
+        if self.failed:
+            return {'error': True}
+        if 'rebalance_fees_spent' in self.result['rebalance']:
+            # bos prints BTC with 8 decimals, rounding gives back the exact sats that float parsing misses.
+            self.result['fees'] = round(float(self.result['rebalance']['rebalance_fees_spent']) * pow(10, 8))
+        return self.result
+
+
+class BosExecutor(Executor):
+
+    def __init__(self, minutes=1, path=None):
+        self.minutes = minutes
+        self.path = path
+
+    def get_command(self) -> list:
+        if self.path:
+            return [self.path, 'rebalance']
+        elif exists('/usr/local/bin/bos'):
+            return ['/usr/local/bin/bos', 'rebalance']
+        else:
+            return ['/usr/bin/bos', 'rebalance']
+
+    @staticmethod
+    def kill(process: Popen):
+        # bos runs in its own process group, its children are stopped with it.
+        try:
+            killpg(process.pid, SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    def execute(self, rebalance: object, channel_out: dict, channel_in: dict, amount: int) -> dict:
+        remaining = rebalance.get_time_remaining()
+        if remaining <= 0:
+            return {'error': True}
+
+        alias_in = rebalance.lnd.get_node_alias(channel_in['remote_pubkey'])
+        alias_out = rebalance.lnd.get_node_alias(channel_out['remote_pubkey'])
+
+        command = self.get_command()
+        command += ['--amount', str(int(amount)), '--out', alias_out, '--in', alias_in]
+        if rebalance.fee_limit_fixed:
+            command += ['--max-fee', str(int(rebalance.fee_limit_fixed))]
+        elif rebalance.fee_limit_percent:
+            command += ['--max-fee-rate', str(int(rebalance.fee_limit_percent))]
+        for excluded in rebalance.excluded:
+            command += ['--avoid', excluded.replace(' ', '')]
+
+        command += ['--no-color', '--minutes', str(self.minutes)]
+        if rebalance.node_save:
+            command += ['--node', rebalance.node_save]
+
+        lines = self.stream(command, remaining)
+        if rebalance.lnd.recorder is not None:
+            # The binary path is left out, a replay does not depend on where bos is installed.
+            lines = rebalance.lnd.recorder.stream('bos', command[1:], partial(self.stream, command, remaining))
+
+        parser = BosParser()
+        with closing(lines):
+            for line in lines:
+                hops = len(parser.result['hops'])
+                # A failure line ends the attempt, bos is not waited for.
+                if not parser.feed(line):
+                    break
+                if len(parser.result['hops']) != hops:
+                    aliases = ' -> '.join(hop['alias'] for hop in parser.result['hops'])
+                    rebalance.report(channel_in, f'Evaluating {aliases}')
+
+        if 'rebalance_fees_spent' not in parser.result['rebalance']:
+            return {'error': True}
+        return parser.get_result()
+
+    def stream(self, command: list, remaining: float):
+        expired = Event()
+        process = Popen(command, stdout=PIPE, stderr=STDOUT, text=True, start_new_session=True)
+
+        def expire():
+            expired.set()
+            self.kill(process)
+
+        timer = Timer(remaining, expire)
+        timer.start()
+        try:
+            yield from process.stdout
+            if expired.is_set():
+                yield 'err: bos was stopped when the time budget ran out\n'
+        finally:
+            timer.cancel()
+            self.kill(process)
+            process.stdout.close()
+            process.wait()
+
+
+class LndExecutor(Executor):
+
+    def __init__(self, timeout=60, max_routes=10):
+        self.timeout = timeout
+        self.max_routes = max_routes
+
+    @staticmethod
+    def get_ignored_nodes(rebalance: object) -> list:
+        # Like bos --avoid, excluded aliases and pubkeys apply to every hop, not only to our peers.
+        pub_keys = set(rebalance.get_excluded_pubkeys())
+        pub_keys.update(
+            channel['remote_pubkey'] for channel in rebalance.snapshot.get_list_channels()
+            if channel['chan_id'] in rebalance.excluded_chan_ids
+        )
+        return [urlsafe_b64encode(bytes.fromhex(pub_key)).decode() for pub_key in pub_keys]
+
+    def execute(self, rebalance: object, channel_out: dict, channel_in: dict, amount: int) -> dict:
+        lnd = rebalance.lnd
+        fee_limit = rebalance.get_fee_limit(amount)
+        invoice = lnd.add_invoice(amount, memo='autorebalance', expiry=self.timeout * 2)
+        if not invoice.get('r_hash'):
+            return {'error': True}
+
+        params = {
+            'outgoing_chan_id': channel_out['chan_id'],
+            'last_hop_pubkey': urlsafe_b64encode(bytes.fromhex(channel_in['remote_pubkey'])).decode(),
+            'fee_limit.fixed': fee_limit,
+            'use_mission_control': 'true',
+            'ignored_nodes': self.get_ignored_nodes(rebalance)
+        }
+        timestamp, hops = time(), []
+        timeout = min(self.timeout, rebalance.get_time_remaining())
+        for index in range(self.max_routes):
+            if (time() - timestamp) >= timeout:
+                break
+
+            routes = lnd.query_routes(lnd.get_own_pubkey(), amount, params).get('routes')
+            if not routes:
+                break
+
+            route = routes[0]
+            # Progress never waits on the node, unknown hops are shown by a short pubkey.
+            aliases = ' -> '.join(
+                (lnd.cache.get(hop['pub_key']) or {}).get('alias') or hop['pub_key'][:16] for hop in route['hops'][:-1]
+            )
+            rebalance.report(channel_in, f'Route {index + 1}/{self.max_routes} {aliases}')
+            route['hops'][-1]['mpp_record'] = {
+                'payment_addr': invoice['payment_addr'], 'total_amt_msat': str(int(amount) * 1000)
+            }
+            attempt = lnd.send_to_route(invoice['r_hash'], route)
+            if attempt.get('status') == 'SUCCEEDED':
+                return self.parser_route(lnd, route)
+            hops = self.get_failure_hops(route, attempt)
+        return {'error': True, 'hops': hops}
+
+    @staticmethod
+    def get_failure_hops(route: dict, attempt: dict) -> list:
+        # The failure source index counts our own node as zero.
+        index = int(attempt.get('failure', {}).get('failure_source_index', 0))
+        if 0 < index <= len(route['hops']) - 1:
+            return [{'pubkey': route['hops'][index - 1]['pub_key']}]
+        return []
+
+    @staticmethod
+    def parser_route(lnd: object, route: dict) -> dict:
+        # Same shape as Rebalance.parser_rebalance, the last hop is our own node.
+        hops = [
+            {'alias': lnd.get_node_alias(hop['pub_key']), 'pubkey': hop['pub_key']} for hop in route['hops'][:-1]
+        ]
+        # Partial sats are rounded up, the budget never counts less than was paid.
+        fees = -(-int(route.get('total_fees_msat', 0)) // 1000)
+        return {
+            'error': False,
+            'hops': hops,
+            'fees': fees,
+            'rebalance': {'rebalance_fees_spent': f'{fees / pow(10, 8):.8f}'}
+        }
+
+
+EXECUTORS = {'lnd': LndExecutor, 'bos': BosExecutor}
@@ -0,0 +1,102 @@
+from json import load
+from gzip import open as gzip_open
+from array import array
+from heapq import heappop, heappush
+from threading import Lock
+from os.path import expanduser
+
+
+class Graph:
+
+    def __init__(self, graph: dict):
+        self.pubkeys = []
+        self.indexes = {}
+        self.chan_ids = []
+        self.lock = Lock()
+        self.fees = {}
+
+        sources, targets, fee_base, fee_rate, capacity, channels = [], [], [], [], [], []
+        for edge in graph.get('edges', []):
+            channel = len(self.chan_ids)
+            self.chan_ids.append(edge['channel_id'])
+            for source, target, policy in (
+                    (edge['node1_pub'], edge['node2_pub'], edge.get('node1_policy')),
+                    (edge['node2_pub'], edge['node1_pub'], edge.get('node2_policy'))):
+                if not policy or policy.get('disabled'):
+                    continue
+                sources.append(self.index(source))
+                targets.append(self.index(target))
+                fee_base.append(int(policy.get('fee_base_msat', 0)))
+                fee_rate.append(int(policy.get('fee_rate_milli_msat', 0)))
+                capacity.append(int(edge.get('capacity', 0)))
+                channels.append(channel)
+
+        # Directed edges grouped by the node they lead to, the search walks back from the last hop.
+        order = sorted(range(len(targets)), key=targets.__getitem__)
+        self.offsets = array('q', bytes(8 * (len(self.pubkeys) + 1)))
+        for target in targets:
+            self.offsets[target + 1] += 1
+        for node in range(len(self.pubkeys)):
+            self.offsets[node + 1] += self.offsets[node]
+
+        self.sources = array('q', (sources[edge] for edge in order))
+        self.fee_base = array('q', (fee_base[edge] for edge in order))
+        self.fee_rate = array('q', (fee_rate[edge] for edge in order))
+        self.capacity = array('q', (capacity[edge] for edge in order))
+        self.channels = array('q', (channels[edge] for edge in order))
+
+    def index(self, pubkey: str) -> int:
+        if pubkey not in self.indexes:
+            self.indexes[pubkey] = len(self.pubkeys)
+            self.pubkeys.append(pubkey)
+        return self.indexes[pubkey]
+
+    def __contains__(self, pubkey: str) -> bool:
+        return pubkey in self.indexes
+
+    @classmethod
+    def from_lnd(cls, lnd: object) -> 'Graph':
+        return cls(lnd.get_graph())
+
+    @classmethod
+    def from_file(cls, path: str) -> 'Graph':
+        # Output of `lncli describegraph` or of the v1/graph endpoint, optionally gzipped.
+        path = expanduser(path)
+        with (gzip_open(path, 'rt') if path.endswith('.gz') else open(path)) as file:
+            return cls(load(file))
+
+    def get_fees(self, pubkey: str, amount: int, limit=None, excluded=()) -> dict:
+        # Cheapest fee in msat from every node to pubkey for amount sats, nodes above limit are left out.
+        key = (pubkey, int(amount), limit, tuple(sorted(excluded)))
+        with self.lock:
+            if key in self.fees:
+                return self.fees[key]
+
+        target = self.indexes.get(pubkey)
+        if target is None:
+            return {}
+
+        excluded = {self.indexes[node] for node in excluded if node in self.indexes}
+        amount_msat = int(amount) * 1000
+        fees, heap = {target: 0}, [(0, target)]
+        while heap:
+            fee, node = heappop(heap)
+            if fee > fees[node]:
+                continue
+            for edge in range(self.offsets[node], self.offsets[node + 1]):
+                source = self.sources[edge]
+                if source in excluded or self.capacity[edge] < amount:
+                    continue
+
+                # The forwarding node charges its own policy, compounding is ignored so this is a lower bound.
+                cost = fee + self.fee_base[edge] + amount_msat * self.fee_rate[edge] // 1_000_000
+                if limit is not None and cost > limit:
+                    continue
+                if cost < fees.get(source, cost + 1):
+                    fees[source] = cost
+                    heappush(heap, (cost, source))
+
+        fees = {self.pubkeys[node]: fee for node, fee in fees.items()}
+        with self.lock:
+            self.fees[key] = fees
+        return fees
@@ -0,0 +1,84 @@
+from json import dumps, loads
+from time import time
+from threading import RLock
+from os.path import expanduser
+
+import sqlite3
+
+
+class History:
+
+    def __init__(self, path=None, half_life=86400):
+        self.path = expanduser(path) if path else ':memory:'
+        self.half_life = float(half_life)
+        self.lock = RLock()
+        self.pairs = {}
+        self.failures = {}
+        self.hops = {}
+
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS attempts ('
+            'timestamp REAL, chan_id_out TEXT, chan_id_in TEXT, amount INTEGER, '
+            'fees INTEGER, latency REAL, hops TEXT, success INTEGER)'
+        )
+        self.connection.commit()
+
+        # Attempts older than ten half lives weigh less than 0.1% and are not replayed.
+        rows = self.connection.execute(
+            'SELECT timestamp, chan_id_out, chan_id_in, hops, success, amount FROM attempts '
+            'WHERE timestamp > ? ORDER BY timestamp', (time() - 10 * self.half_life, )
+        )
+        for timestamp, chan_id_out, chan_id_in, hops, success, amount in rows:
+            self.learn(timestamp, chan_id_out, chan_id_in, loads(hops), bool(success), amount)
+
+    def decay(self, score: list, timestamp: float) -> list:
+        weight = pow(0.5, max(0, timestamp - score[2]) / self.half_life)
+        return [score[0] * weight, score[1] * weight, max(timestamp, score[2])]
+
+    def update(self, scores: dict, key: object, timestamp: float, success: bool):
+        score = self.decay(scores.get(key, [0.0, 0.0, timestamp]), timestamp)
+        score[0 if success else 1] += 1
+        scores[key] = score
+
+    def learn(self, timestamp: float, chan_id_out: int, chan_id_in: int, hops: list, success: bool, amount=0):
+        self.update(self.pairs, (chan_id_out, chan_id_in), timestamp, success)
+        if not success:
+            # Failures are also kept by amount, a failed large attempt says little about a smaller one.
+            self.update(self.failures.setdefault((chan_id_out, chan_id_in), {}), int(amount or 0), timestamp, success)
+        for hop in hops:
+            self.update(self.hops, hop['pubkey'], timestamp, success)
+
+    def record(
+            self, chan_id_out: int, chan_id_in: int, amount: int, fees: int, latency: float, hops: list, success: bool
+        ):
+        timestamp = time()
+        hops = [{'pubkey': hop['pubkey']} for hop in hops]
+        with self.lock:
+            self.learn(timestamp, chan_id_out, chan_id_in, hops, success, amount)
+            self.connection.execute(
+                'INSERT INTO attempts VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (timestamp, chan_id_out, chan_id_in, int(amount), int(fees), latency, dumps(hops), int(success))
+            )
+            self.connection.commit()
+
+    def get_score(self, scores: dict, key: object) -> tuple:
+        score = scores.get(key)
+        if not score:
+            return 0.0, 0.0
+        score = self.decay(score, time())
+        return score[0], score[1]
+
+    def get_pair(self, chan_id_out: int, chan_id_in: int) -> tuple:
+        return self.get_score(self.pairs, (chan_id_out, chan_id_in))
+
+    def get_failures(self, chan_id_out: int, chan_id_in: int, amount: int) -> float:
+        failures = self.failures.get((chan_id_out, chan_id_in), {})
+        return sum(self.get_score(failures, key)[1] for key in list(failures) if key <= amount)
+
+    def get_hop(self, pub_key: str) -> tuple:
+        return self.get_score(self.hops, pub_key)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
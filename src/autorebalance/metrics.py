@@ -0,0 +1,143 @@
+from json import dumps
+from time import time, perf_counter
+from os import replace
+from threading import Lock
+from collections import deque
+from contextlib import contextmanager
+from os.path import expanduser
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class Metrics:
+
+    def __init__(self, prefix='autorebalance', buckets=BUCKETS, max_events=1_000):
+        self.prefix = prefix
+        self.buckets = tuple(buckets)
+        self.lock = Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.events = deque(maxlen=max_events)
+        self.collectors = []
+
+    @staticmethod
+    def key(name: str, labels: dict) -> tuple:
+        return name, tuple(sorted(labels.items()))
+
+    def increment(self, name: str, value=1, **labels):
+        key = self.key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name: str, value: int, **labels):
+        with self.lock:
+            self.counters[self.key(name, labels)] = value
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = self.key(name, labels)
+        with self.lock:
+            # Bucket counts are not cumulative here, export_prometheus() accumulates them.
+            histogram = self.histograms.setdefault(key, [[0] * (len(self.buckets) + 1), 0.0, 0, 0.0])
+            index = next((i for i, bucket in enumerate(self.buckets) if seconds <= bucket), len(self.buckets))
+            histogram[0][index] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+            histogram[3] = max(histogram[3], seconds)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        timestamp = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, perf_counter() - timestamp, **labels)
+
+    def record(self, name: str, **fields):
+        with self.lock:
+            self.events.append(dict(fields, event=name, timestamp=time()))
+
+    def collect(self):
+        # Values owned by other objects (lru_cache statistics) are read when metrics are exported.
+        for collector in self.collectors:
+            collector(self)
+
+    def get_quantile(self, histogram: list, quantile: float) -> float:
+        # Upper bound of the bucket holding the quantile, the maximum for the last bucket.
+        count = 0
+        for index, bucket in enumerate(histogram[0]):
+            count += bucket
+            if count >= quantile * histogram[2]:
+                return self.buckets[index] if index < len(self.buckets) else histogram[3]
+        return histogram[3]
+
+    def summary(self) -> list:
+        self.collect()
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+
+        rows = []
+        for (name, labels), histogram in histograms:
+            rows.append({
+                'name': name,
+                'labels': dict(labels),
+                'count': histogram[2],
+                'total': histogram[1],
+                'mean': histogram[1] / histogram[2],
+                'p95': min(self.get_quantile(histogram, 0.95), histogram[3]),
+                'max': histogram[3]
+            })
+        for (name, labels), value in counters:
+            rows.append({'name': name, 'labels': dict(labels), 'count': value})
+        return rows
+
+    @staticmethod
+    def format_labels(labels: dict) -> str:
+        if not labels:
+            return ''
+        labels = ','.join(
+            '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+            for name, value in labels.items()
+        )
+        return f'{{{labels}}}'
+
+    def export_prometheus(self, path: str):
+        self.collect()
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+
+        lines = []
+        for (name, labels), value in counters:
+            name = f'{self.prefix}_{name}'
+            if f'# TYPE {name} counter' not in lines:
+                lines.append(f'# TYPE {name} counter')
+            lines.append(f'{name}{self.format_labels(dict(labels))} {value}')
+
+        for (name, labels), histogram in histograms:
+            name = f'{self.prefix}_{name}'
+            if f'# TYPE {name} histogram' not in lines:
+                lines.append(f'# TYPE {name} histogram')
+            count = 0
+            for bucket, value in zip(self.buckets + ('+Inf', ), histogram[0]):
+                count += value
+                lines.append(f'{name}_bucket{self.format_labels(dict(labels, le=bucket))} {count}')
+            lines.append(f'{name}_sum{self.format_labels(dict(labels))} {histogram[1]}')
+            lines.append(f'{name}_count{self.format_labels(dict(labels))} {histogram[2]}')
+
+        # node_exporter must never read a partially written file.
+        path = expanduser(path)
+        with open(f'{path}.tmp', 'w') as file:
+            file.write('\n'.join(lines) + '\n')
+        replace(f'{path}.tmp', path)
+
+    def export_jsonl(self, path: str):
+        summary = self.summary()
+        with self.lock:
+            events = list(self.events)
+            self.events.clear()
+
+        with open(expanduser(path), 'a') as file:
+            for event in events:
+                file.write(dumps(event) + '\n')
+            file.write(dumps({'event': 'summary', 'timestamp': time(), 'metrics': summary}) + '\n')
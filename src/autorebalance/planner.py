@@ -0,0 +1,66 @@
+class Planner:
+
+    def __init__(
+            self, amount: int, history: object, max_failures=2, liquidity_weight=1.0, fee_weight=1.0, fee_scale=1000):
+        self.amount = max(1, int(amount))
+        self.history = history
+        self.max_failures = max_failures
+        self.liquidity_weight = liquidity_weight
+        self.fee_weight = fee_weight
+        self.fee_scale = max(1, int(fee_scale))
+
+    def is_dead(self, chan_id_out: int, chan_id_in: int) -> bool:
+        # Only failures at the minimum amount count, adaptive attempts above it are still bisecting.
+        successes, _ = self.history.get_pair(chan_id_out, chan_id_in)
+        failures = self.history.get_failures(chan_id_out, chan_id_in, self.amount)
+        return round(successes) == 0 and round(failures) >= self.max_failures
+
+    @staticmethod
+    def get_ratio(successes: float, failures: float) -> float:
+        return (successes + 1) / (successes + failures + 2)
+
+    def get_probability(self, table: object, index_out: int, index_in: int) -> float:
+        probability = self.get_ratio(*self.history.get_pair(table.chan_ids[index_out], table.chan_ids[index_in]))
+        probability *= self.get_ratio(*self.history.get_hop(table.remote_pubkeys[index_out]))
+        probability *= self.get_ratio(*self.history.get_hop(table.remote_pubkeys[index_in]))
+        return probability
+
+    def score(self, table: object, index_out: int, index_in: int) -> float:
+        surplus = table.local_available[index_out] - table.capacity_available[index_out] // 2
+        deficit = table.capacity_available[index_in] // 2 - table.local_available[index_in]
+        liquidity = min(1.0, max(0, min(surplus, deficit)) / (10 * self.amount))
+
+        # Liquidity is worth more where we charge more than on the channel it is taken from.
+        fee_rate = table.local_fee_rate[index_in] - table.local_fee_rate[index_out]
+        fee_rate = (min(self.fee_scale, max(-self.fee_scale, fee_rate)) + self.fee_scale) / (2 * self.fee_scale)
+
+        # Both terms are within [0, 1], the value is never negative so a likelier pair never scores lower.
+        value = self.liquidity_weight * liquidity + self.fee_weight * fee_rate
+        return self.get_probability(table, index_out, index_in) * value
+
+    def rank(self, table: object, indexes_out: list, indexes_in: list) -> list:
+        pairs = []
+        for index_in in indexes_in:
+            for index_out in indexes_out:
+                if table.remote_pubkeys[index_out] == table.remote_pubkeys[index_in]:
+                    continue
+                if self.is_dead(table.chan_ids[index_out], table.chan_ids[index_in]):
+                    continue
+                pairs.append((self.score(table, index_out, index_in), index_out, index_in))
+        return sorted(pairs, key=lambda pair: pair[0], reverse=True)
+
+    def assign(self, table: object, indexes_out: list, indexes_in: list) -> list:
+        # Greedy matching, every inbound channel keeps the position of its best free pair.
+        assigned_out, assigned_in, order = set(), set(), []
+        pairs = self.rank(table, indexes_out, indexes_in)
+        for _, index_out, index_in in pairs:
+            if index_out not in assigned_out and index_in not in assigned_in:
+                assigned_out.add(index_out)
+                assigned_in.add(index_in)
+                order.append(index_in)
+
+        for _, _, index_in in pairs:
+            if index_in not in assigned_in:
+                assigned_in.add(index_in)
+                order.append(index_in)
+        return order
@@ -1,26 +1,121 @@
-from os import popen
+from json import loads
+from base64 import urlsafe_b64encode
+from math import ceil
+from string import hexdigits
 from time import time
-from parser import expr as parser
-from random import choice
-from os.path import expanduser, exists
-from requests import request
-from functools import lru_cache
+from os.path import expanduser
+from requests import Session
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from functools import lru_cache, partial
+from threading import Condition, Event, RLock
+from concurrent.futures import ThreadPoolExecutor
+
+import asyncio
+
+from .rules import Rules, compile_rule
+from .cache import NodeCache
+from .metrics import Metrics
+from .state import ChannelState
+from .planner import Planner
+from .sizer import Sizer
+from .history import History
+from .executor import EXECUTORS, BosParser
+from .channels import ChannelTable
 
 class Lnd:
 
-    def __init__(self, lnddir='~/.lnd', rpc='127.0.0.1:8080', network='mainnet'):
+    def __init__(
+            self,
+            lnddir='~/.lnd',
+            rpc='127.0.0.1:8080',
+            network='mainnet',
+            pool_size=10,
+            connect_timeout=5,
+            read_timeout=60,
+            retries=3,
+            backoff=0.5,
+            concurrency=8,
+            cache=None,
+            metrics=None,
+            recorder=None
+        ):
         self.lnddir = expanduser(lnddir)
         self.network = network
-        with open(f'{self.lnddir}/data/chain/bitcoin/{self.network}/admin.macaroon', 'rb', ) as file:
-            self.__macaroon = {'Grpc-Metadata-macaroon': file.read().hex()}
+        self.recorder = recorder
+        # A replayed run never reaches the node, it does not need its credentials either.
+        self.__macaroon = {}
+        if recorder is None or not recorder.replay:
+            with open(f'{self.lnddir}/data/chain/bitcoin/{self.network}/admin.macaroon', 'rb', ) as file:
+                self.__macaroon = {'Grpc-Metadata-macaroon': file.read().hex()}
 
         self.__rpc = f'https://{rpc}'
-        self.__tlscert = f'{lnddir}/tls.cert'
+        self.__tlscert = f'{self.lnddir}/tls.cert'
+        self.__timeout = (connect_timeout, read_timeout)
+
+        # Only idempotent methods are retried, payments must never be sent twice.
+        retry = Retry(
+            total=retries, backoff_factor=backoff, status_forcelist=(500, 502, 503, 504), raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = Session()
+        self.session.headers.update(self.__macaroon)
+        self.session.mount('https://', adapter)
+        self.aio = AsyncLnd(self, concurrency=concurrency)
+        self.cache = cache if cache is not None else NodeCache()
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.metrics.collectors.append(self.collect_metrics)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.aio.close()
+        self.session.close()
+        self.cache.close()
+
+    @staticmethod
+    def get_endpoint(path: str) -> str:
+        # Channel ids, pubkeys and amounts are dropped so every endpoint is one series.
+        parts = path.split('/')
+        return '/'.join(part for part in parts if not (part.isdigit() or len(part) == 66))
 
     def fetch(self, method: str, path: str, data=None, params=None) -> dict:
+        endpoint = self.get_endpoint(path)
+        try:
+            with self.metrics.timer('request_seconds', endpoint=endpoint):
+                if self.recorder is not None:
+                    return self.recorder.play(
+                        'fetch', [method, path, params, data], partial(self.request, method, path, data, params)
+                    )
+                return self.request(method, path, data, params)
+        except Exception:
+            self.metrics.increment('request_errors_total', endpoint=endpoint)
+            raise
+
+    def request(self, method: str, path: str, data=None, params=None) -> dict:
         url = f'{self.__rpc}/{path}'
-        return request(
-            method=method, url=url, headers=self.__macaroon, verify=self.__tlscert, json=data, params=params).json()
+        return self.session.request(
+            method=method, url=url, verify=self.__tlscert, json=data, params=params, timeout=self.__timeout
+        ).json()
+
+    def collect_metrics(self, metrics: Metrics):
+        for name, function in (
+                ('get_info', Lnd.get_info), ('get_own_pubkey', Lnd.get_own_pubkey), ('compile_rule', compile_rule)):
+            info = function.cache_info()
+            metrics.set('cache_hits_total', info.hits, cache=name)
+            metrics.set('cache_misses_total', info.misses, cache=name)
+
+    def subscribe(self, path: str, params=None):
+        url = f'{self.__rpc}/{path}'
+        with self.session.get(
+                url, verify=self.__tlscert, params=params, stream=True, timeout=(self.__timeout[0], None)) as response:
+            for line in response.iter_lines():
+                if line:
+                    yield loads(line).get('result', {})
 
     @lru_cache(maxsize=None)
     def get_info(self) -> dict:
@@ -30,13 +125,17 @@ class Lnd:
     def get_own_pubkey(self) -> str:
         return self.get_info().get('identity_pubkey')
 
-    @lru_cache(maxsize=None)
     def get_node_alias(self, pub_key) -> str:
         return self.get_node_info(pub_key).get('alias')
 
-    @lru_cache(maxsize=None)
     def get_node_info(self, pub_key: str) -> dict:
-        return self.fetch('get', f'v1/graph/node/{pub_key}').get('node')
+        node = self.cache.get(pub_key)
+        self.metrics.increment('cache_misses_total' if node is None else 'cache_hits_total', cache='nodes')
+        if node is None:
+            node = self.fetch('get', f'v1/graph/node/{pub_key}').get('node')
+            if node:
+                self.cache.set(pub_key, node)
+        return node
 
     def get_channel_info(self, chan_id: int) -> dict:
         return self.fetch('get', f'v1/graph/edge/{chan_id}')
@@ -67,14 +166,154 @@ class Lnd:
     def get_fee_base_remote(self, chan_id: int):
         return int(self.get_policy_remote(chan_id)['fee_base_msat'])
 
+    def get_nodes_alias(self, pub_keys: list) -> list:
+        return asyncio.run(self.aio.gather('get_node_alias', pub_keys))
+
+    def get_channels_info(self, chan_ids: list) -> list:
+        return asyncio.run(self.aio.gather('get_channel_info', chan_ids))
+
+    def get_graph(self) -> dict:
+        return self.fetch('get', 'v1/graph')
+
     def get_list_channels(self):
-        channels = filter(lambda channel: channel['active'], self.fetch('get', 'v1/channels')['channels'])
+        channels = filter(lambda channel: channel.get('active'), self.fetch('get', 'v1/channels').get('channels', []))
         return list(channels)
 
-    def filter_list_channel(self, chan_id: int):
-        return list(filter(lambda channel: channel['chan_id'] == chan_id, self.get_list_channels()))
+    def get_list_channels_peer(self, pub_key: str):
+        params = {'peer': urlsafe_b64encode(bytes.fromhex(pub_key)).decode()}
+        channels = self.fetch('get', 'v1/channels', params=params).get('channels', [])
+        return list(filter(lambda channel: channel.get('active'), channels))
+
+    def add_invoice(self, amount: int, memo='', expiry=3600) -> dict:
+        return self.fetch('post', 'v1/invoices', data={'value': str(int(amount)), 'memo': memo, 'expiry': str(expiry)})
+
+    def query_routes(self, pub_key: str, amount: int, params=None) -> dict:
+        return self.fetch('get', f'v1/graph/routes/{pub_key}/{int(amount)}', params=params)
+
+    def send_to_route(self, payment_hash: str, route: dict) -> dict:
+        return self.fetch('post', 'v2/router/route/send', data={'payment_hash': payment_hash, 'route': route})
+
+    def get_list_channels_peers(self, pub_keys: list) -> list:
+        return asyncio.run(self.aio.gather('get_list_channels_peer', pub_keys))
+
+
+
+class AsyncLnd:
+
+    def __init__(self, lnd: object, concurrency=8):
+        self.lnd = lnd
+        self.concurrency = int(concurrency)
+        self.__executor = ThreadPoolExecutor(max_workers=self.concurrency)
+
+    def __getattr__(self, name: str):
+        method = getattr(self.lnd, name)
+        if not callable(method):
+            return method
+
+        async def wrapper(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.__executor, partial(method, *args, **kwargs))
+        return wrapper
+
+    async def gather(self, name: str, args: list) -> list:
+        method = getattr(self, name)
+        return await asyncio.gather(*[method(arg) for arg in args])
+
+    def close(self):
+        self.__executor.shutdown(wait=False)
+
+
+
+class Snapshot:
+
+    def __init__(self, lnd: object, ttl=60, stream=False):
+        self.lnd = lnd
+        self.ttl = int(ttl)
+        self.state = ChannelState(lnd, stream=stream)
+        self.channels = {}
+        self.edges = {}
+        self.table = None
+        self.version = None
+        self.channels_timestamp = 0
+        self.edges_timestamp = 0
+        self.lock = RLock()
+        self.state.start()
+
+    def refresh(self):
+        with self.lock:
+            changed = self.table is None
+            # Without the event streams the whole list is reloaded once the ttl expires.
+            if not self.state.stream and (time() - self.channels_timestamp) >= self.ttl:
+                self.state.invalidate()
+                self.channels_timestamp = time()
+
+            channels = self.state.get_channels()
+            if self.state.version != self.version:
+                self.channels = dict(channels)
+                self.version = self.state.version
+                changed = True
+
+            if (time() - self.edges_timestamp) >= self.ttl:
+                self.edges = {}
+                self.edges_timestamp = time()
+
+            chan_ids = [chan_id for chan_id in self.channels if chan_id not in self.edges]
+            self.lnd.metrics.increment('cache_hits_total', len(self.channels) - len(chan_ids), cache='edges')
+            self.lnd.metrics.increment('cache_misses_total', len(chan_ids), cache='edges')
+            if chan_ids:
+                self.edges.update(zip(chan_ids, self.lnd.get_channels_info(chan_ids)))
+                changed = True
+
+            if changed:
+                self.table = ChannelTable(
+                    list(self.channels.values()),
+                    [self.get_policy(self.edges[chan_id], local=True) for chan_id in self.channels],
+                    [self.get_policy(self.edges[chan_id], local=False) for chan_id in self.channels]
+                )
+
+    def get_table(self) -> ChannelTable:
+        self.refresh()
+        return self.table
+
+    def get_list_channels(self):
+        self.refresh()
+        return list(self.channels.values())
+
+    def get_channel(self, chan_id: int) -> dict:
+        return self.state.get_channel(chan_id)
+
+    def get_channel_info(self, chan_id: int) -> dict:
+        with self.lock:
+            self.refresh()
+            if chan_id not in self.edges:
+                self.edges[chan_id] = self.lnd.get_channel_info(chan_id)
+            return self.edges[chan_id]
+
+    def get_policy(self, channel_info: dict, local=True) -> dict:
+        if (channel_info['node1_pub'] == self.lnd.get_own_pubkey()) == local:
+            return channel_info['node1_policy']
+        else:
+            return channel_info['node2_policy']
+
+    def get_policy_local(self, chan_id: int) -> dict:
+        return self.get_policy(self.get_channel_info(chan_id), local=True)
+
+    def get_policy_remote(self, chan_id: int) -> dict:
+        return self.get_policy(self.get_channel_info(chan_id), local=False)
+
+    def get_fee_rate_local(self, chan_id: int):
+        return self.get_table().row(chan_id).local_fee_rate
+
+    def get_fee_base_local(self, chan_id: int):
+        return self.get_table().row(chan_id).local_fee_base
+
+    def get_fee_rate_remote(self, chan_id: int):
+        return self.get_table().row(chan_id).remote_fee_rate
+
+    def get_fee_base_remote(self, chan_id: int):
+        return self.get_table().row(chan_id).remote_fee_base
+
 
-    
 class Rebalance:
 
     def __init__(
@@ -88,15 +327,30 @@ class Rebalance:
             fee_limit_percent=0,
             excluded=[],
             expressions=[],
-            limit_rebalance=1
+            limit_rebalance=1,
+            snapshot_ttl=60,
+            stream=False,
+            executor='lnd',
+            history=None,
+            adaptive=False,
+            max_amount=0,
+            graph=None
         ):
         self.lnd = lnd
+        self.executor = EXECUTORS[executor]() if isinstance(executor, str) else executor
+        self.snapshot = Snapshot(lnd, ttl=snapshot_ttl, stream=stream)
         self.amount = int(amount)
         self.excluded = list(excluded)
+        self.excluded_chan_ids = set(self.excluded)
+        self.excluded_pubkeys = set()
+        self.excluded_timestamp = None
         self.timeout = int(timeout)
         self.node_save = node_save
         self.timestamp = time()
         self.expressions = list(expressions)
+        self.rules = Rules(self.expressions)
+        self.eligible = set()
+        self.eligible_timestamp = None
 
         self.max_total_fees = int(max_total_fees)
         self.limit_rebalance = limit_rebalance
@@ -107,6 +361,44 @@ class Rebalance:
         self.total_rebalance_amount = 0
         self.total_rebalance_channels = 0
 
+        self.history = history if history is not None else History()
+        self.planner = Planner(self.amount, self.history)
+        self.sizer = Sizer(self.amount, max_amount=max_amount, adaptive=adaptive)
+        self.graph = graph
+        self.busy = set()
+        self.stopped = Event()
+        self.condition = Condition()
+        self.reserved_fees = 0
+        self.reserved_channels = 0
+        self.progress = None
+
+    def reset(self, budget=True):
+        # Without budget, the fees and rebalances spent so far still count against the limits.
+        with self.condition:
+            self.timestamp = time()
+            if budget:
+                self.total_rebalance_fees = 0
+                self.total_rebalance_amount = 0
+                self.total_rebalance_channels = 0
+            # Nothing is in flight between two cycles, whatever is still held was leaked.
+            self.reserved_fees = 0
+            self.reserved_channels = 0
+            self.busy.clear()
+            self.sizer.reset()
+
+    def stop(self):
+        self.stopped.set()
+        with self.condition:
+            self.condition.notify_all()
+
+    def get_time_remaining(self) -> float:
+        return max(0, self.timeout - (time() - self.timestamp))
+
+    def report(self, channel: dict, message=None):
+        # Partial progress of the attempt on channel, None once it is finished.
+        if self.progress:
+            self.progress(channel, message)
+
     @staticmethod
     def get_local_available(channel: dict):
         return max(0, int(channel['local_balance']) - int(channel['local_chan_reserve_sat']))
@@ -118,45 +410,100 @@ class Rebalance:
     def get_capacity_available(self, channel: dict):
         return self.get_local_available(channel) + self.get_remote_available(channel)
     
+    def get_deficit(self, channel: dict) -> int:
+        return self.get_capacity_available(channel) // 2 - self.get_local_available(channel)
+
+    def get_surplus(self, channel: dict) -> int:
+        return self.get_local_available(channel) - self.get_capacity_available(channel) // 2
+
     def get_ratio_channel(self, channel: dict):
         ratio = int(10 * self.get_local_available(channel) / self.get_capacity_available(channel))
         return {'remote': 10 - ratio, 'local': ratio}
 
+    def get_excluded_pubkeys(self) -> set:
+        # Excluded aliases are resolved again only when the snapshot or the node cache changed.
+        timestamp = (self.snapshot.version, len(self.lnd.cache))
+        if self.excluded_timestamp != timestamp:
+            self.excluded_pubkeys = self.lnd.cache.get_pubkeys(self.excluded)
+            # Pubkeys are taken as they are, like bos --avoid does.
+            self.excluded_pubkeys.update(
+                excluded for excluded in self.excluded
+                if isinstance(excluded, str) and len(excluded) == 66 and all(x in hexdigits for x in excluded)
+            )
+            self.excluded_timestamp = timestamp
+        return self.excluded_pubkeys
+
     def ignore_channel_excluded(self, channel: dict) -> bool:
-        get_node_pubkey = channel.get('remote_pubkey')
-        get_node_alias = self.lnd.get_node_alias(get_node_pubkey)
-        get_chan_id = channel.get('chan_id')
-        if get_node_alias in self.excluded:
-            return True
-        elif get_node_alias in self.excluded:
-            return True
-        elif get_chan_id in self.excluded:
+        if channel.get('chan_id') in self.excluded_chan_ids:
             return True
         else:
-            return False
+            return channel.get('remote_pubkey') in self.get_excluded_pubkeys()
 
     def get_list_channels(self):
         channels = []
-        for channel in self.lnd.get_list_channels():
+        pub_keys = set(channel['remote_pubkey'] for channel in self.snapshot.get_list_channels())
+        pub_keys = [pub_key for pub_key in pub_keys if pub_key not in self.lnd.cache]
+        if pub_keys:
+            self.lnd.get_nodes_alias(pub_keys)
+        for channel in self.snapshot.get_list_channels():
             if not self.ignore_channel_excluded(channel):
                 channels.append(channel)
         return channels
 
+    def get_list_indexes(self) -> list:
+        table = self.snapshot.get_table()
+        return [table.indexes[channel['chan_id']] for channel in self.get_list_channels()]
+
     def get_list_channels_low_outbound(self):
-        channels = []
-        for channel in self.get_list_channels():
-            ratio = self.get_ratio_channel(channel)
-            if ratio['local'] < ratio['remote']:
-                channels.append(channel)
-        return sorted(channels, key=lambda x: self.get_local_available(x))
+        with self.snapshot.lock:
+            table = self.snapshot.get_table()
+            eligible = self.get_channels_eligible()
+            indexes = table.get_low_outbound(
+                [index for index in self.get_list_indexes() if table.chan_ids[index] in eligible]
+            )
+            return [self.snapshot.channels[table.chan_ids[index]] for index in indexes]
 
     def get_list_channels_high_outbound(self):
-        channels = []
-        for channel in self.get_list_channels():
-            ratio = self.get_ratio_channel(channel)
-            if ratio['local'] > ratio['remote']:
-                channels.append(channel)
-        return sorted(channels, key=lambda x: self.get_remote_available(x), reverse=True)
+        with self.snapshot.lock:
+            table = self.snapshot.get_table()
+            indexes = table.get_high_outbound(self.get_list_indexes())
+            return [self.snapshot.channels[table.chan_ids[index]] for index in indexes]
+
+    def get_list_channels_planned(self):
+        with self.snapshot.lock:
+            table = self.snapshot.get_table()
+            indexes_in = [table.indexes[channel['chan_id']] for channel in self.get_list_channels_low_outbound()]
+            indexes_out = table.get_high_outbound(self.get_list_indexes())
+            with self.lnd.metrics.timer('plan_seconds'):
+                indexes = self.planner.assign(table, indexes_out, indexes_in)
+            return [self.snapshot.channels[table.chan_ids[index]] for index in indexes]
+
+    def get_list_channels_candidates(self, channel: dict):
+        with self.snapshot.lock:
+            table = self.snapshot.get_table()
+            indexes_out = table.get_high_outbound(self.get_list_indexes())
+            pairs = self.planner.rank(table, indexes_out, [table.indexes[channel['chan_id']]])
+            return [self.snapshot.channels[table.chan_ids[index_out]] for _, index_out, _ in pairs]
+
+    def get_list_channels_feasible(self, channel: dict, channels_out: list) -> list:
+        # Pairs whose cheapest circular route already costs more than the fee limit are not attempted.
+        fee_limit = self.get_fee_limit(self.amount) * 1000
+        if self.graph is None or not fee_limit or channel['remote_pubkey'] not in self.graph:
+            return channels_out
+
+        row = self.snapshot.get_table().row(channel['chan_id'])
+        fee_limit -= row.remote_fee_base + self.amount * 1000 * row.remote_fee_rate // pow(10, 6)
+        fees = self.graph.get_fees(
+            channel['remote_pubkey'], self.amount, limit=max(0, fee_limit), excluded=(self.lnd.get_own_pubkey(), )
+        ) if fee_limit >= 0 else {}
+
+        # Peers missing from the public graph cannot be estimated and are kept.
+        feasible = [
+            channel_out for channel_out in channels_out
+            if channel_out['remote_pubkey'] in fees or channel_out['remote_pubkey'] not in self.graph
+        ]
+        self.lnd.metrics.increment('pairs_infeasible_total', len(channels_out) - len(feasible))
+        return feasible
 
     def get_local_available_percentage(self, channel: dict):
         local_available = self.get_local_available(channel)
@@ -168,91 +515,198 @@ class Rebalance:
         capacity_available = self.get_capacity_available(channel)
         return round((remote_available / float(capacity_available)) * 100)
 
-    def parser_expr(self, channel: dict):
-        SPECIAL_CHARS = [
-            'REMOTE_AVAILABLE_PERCENTAGE', 'LOCAL_AVAILABLE_PERCENTAGE',
-            'LOCAL_AVAILABLE', 'REMOTE_AVAILABLE', 'CAPACITY_AVAILABLE',
-            'LOCAL_FEE_RATE', 'LOCAL_FEE_BASE',
-            'REMOTE_FEE_RATE', 'REMOTE_FEE_BASE'
-        ]
-        channel['local_fee_rate'] = self.lnd.get_fee_rate_local(channel['chan_id'])
-        channel['local_fee_base'] = self.lnd.get_fee_base_local(channel['chan_id'])
-
-        channel['remote_fee_rate'] = self.lnd.get_fee_rate_remote(channel['chan_id'])
-        channel['remote_fee_base'] = self.lnd.get_fee_base_remote(channel['chan_id'])
-
-        channel['local_available'] = self.get_local_available(channel)
-        channel['remote_available'] = self.get_remote_available(channel)
-        channel['capacity_available'] = self.get_capacity_available(channel)
-
-        channel['local_available_percentage'] = self.get_local_available_percentage(channel)
-        channel['remote_available_percentage'] = self.get_remote_available_percentage(channel)
+    def get_channel_variables(self, channel: dict) -> dict:
+        policy_local = self.snapshot.get_policy_local(channel['chan_id'])
+        policy_remote = self.snapshot.get_policy_remote(channel['chan_id'])
+        return {
+            'LOCAL_FEE_RATE': int(policy_local['fee_rate_milli_msat']),
+            'LOCAL_FEE_BASE': int(policy_local['fee_base_msat']),
+            'REMOTE_FEE_RATE': int(policy_remote['fee_rate_milli_msat']),
+            'REMOTE_FEE_BASE': int(policy_remote['fee_base_msat']),
+            'LOCAL_AVAILABLE': self.get_local_available(channel),
+            'REMOTE_AVAILABLE': self.get_remote_available(channel),
+            'CAPACITY_AVAILABLE': self.get_capacity_available(channel),
+            'LOCAL_AVAILABLE_PERCENTAGE': self.get_local_available_percentage(channel),
+            'REMOTE_AVAILABLE_PERCENTAGE': self.get_remote_available_percentage(channel)
+        }
 
-        for expr in self.expressions:
-            expr = expr[3:-1] if ('IF' in expr) else expr
-            expr = ' '.join(
-                list(map(lambda x: str(channel[x.lower()]) if x in SPECIAL_CHARS else x, expr.split()))
-            )
-            if (not '__import__' in expr) or (not 'eval' in expr) or (not '__' in expr):
-                return eval(parser(expr).compile(), {'__builtins__': {}}, {})
-            else:
-                return False
-        return True
+    @staticmethod
+    def get_row_variables(row: object) -> dict:
+        return {
+            'LOCAL_FEE_RATE': row.local_fee_rate,
+            'LOCAL_FEE_BASE': row.local_fee_base,
+            'REMOTE_FEE_RATE': row.remote_fee_rate,
+            'REMOTE_FEE_BASE': row.remote_fee_base,
+            'LOCAL_AVAILABLE': row.local_available,
+            'REMOTE_AVAILABLE': row.remote_available,
+            'CAPACITY_AVAILABLE': row.capacity_available,
+            'LOCAL_AVAILABLE_PERCENTAGE': row.local_available_percentage,
+            'REMOTE_AVAILABLE_PERCENTAGE': row.remote_available_percentage
+        }
+
+    def parser_expr(self, channel: dict) -> bool:
+        with self.lnd.metrics.timer('rules_seconds', scope='channel'):
+            return self.rules.evaluate(self.get_channel_variables(channel))
+
+    def get_channels_eligible(self) -> set:
+        with self.snapshot.lock:
+            self.snapshot.refresh()
+            timestamp = (self.snapshot.version, self.snapshot.edges_timestamp)
+            if self.eligible_timestamp != timestamp:
+                table = self.snapshot.get_table()
+                channels = {
+                    channel['chan_id']: self.get_row_variables(table.row(channel['chan_id']))
+                    for channel in self.get_list_channels()
+                }
+                with self.lnd.metrics.timer('rules_seconds', scope='table'):
+                    self.eligible = self.rules.filter(channels)
+                self.eligible_timestamp = timestamp
+            return self.eligible
 
     @staticmethod
     def parser_rebalance(rebalance: str):
-        if 'err' in rebalance:
-            return {'error': True}
-        else:
-            d = {'error': False, 'hops': [], 'rebalance': {}}
-            k = ''
-            for x in rebalance.split('\n'):
-                x = x.strip().replace(':', '').replace('-', '')
-                if 'evaluating' != k and 'evaluating' == x:
-                    k = 'evaluating'
-                elif 'rebalance' != k and 'rebalance' == x:
-                    k = 'rebalance'
-                else:
-                    z = x.split()
-                    if len(z) == 6 and k == 'evaluating':
-                        d['hops'].append({'alias': z[0], 'pubkey': z[1][:-1]})
-                    elif len(z) == 2 and k == 'rebalance':
-                        d['rebalance'].update({z[0]: z[1]})
-                    elif len(z) == 3 and k == 'rebalance':
-                        d['rebalance'].update({z[0]: z[2][1:-1]})
-                    else:
-                        if len(z) == 3:
-                            d[z[0]] = {'alias': z[1], 'pubkey': z[2]}
-                        if len(z) == 2:
-                            d[z[0]] = z[1]
-            return d
-
-    def exec_rebalance(self, channel: str):
-        if exists('/usr/local/bin/bos'):
-            command = '/usr/local/bin/bos rebalance'
-        else:
-            command = '/usr/bin/bos rebalance'
-
-        channel_in = self.lnd.get_node_alias(channel['remote_pubkey'])
-        self.excluded.append(channel_in)
-        
-        channel_out = self.get_list_channels_high_outbound()
-        if not channel_out:
-            return {'error': True}
+        parser = BosParser()
+        for line in rebalance.split('\n'):
+            if not parser.feed(line):
+                break
+        return parser.get_result()
+
+    def get_fee_limit(self, amount=None) -> int:
+        amount = self.amount if amount is None else amount
+        if self.fee_limit_fixed:
+            return int(self.fee_limit_fixed)
         else:
-            self.excluded.remove(channel_in)
-            channel_out = self.lnd.get_node_alias(choice(channel_out)['remote_pubkey'])
-
-            command += f' --amount {int(self.amount)} --out {channel_out} --in {channel_in}'
-            if self.fee_limit_fixed:
-                command += f' --max-fee {int(self.fee_limit_fixed)}'
-            elif self.fee_limit_percent:
-                command += f' --max-fee-rate {int(self.fee_limit_percent)}'
-            for channel in self.excluded:
-                command += f' --avoid {channel.replace(" ", "")}'
-
-            command += ' --no-color --minutes 1'
-            if self.node_save:
-                command += f' --node {self.node_save}'
-        rebalance = popen(f'{command} 2>&1').read().strip()
-        return self.parser_rebalance(rebalance)
+            return ceil(amount * int(self.fee_limit_percent) / pow(10, 6))
+
+    def get_amount_target(self, channel: dict) -> int:
+        target = self.sizer.get_target(self.get_deficit(channel))
+        # With a fee rate limit the worst case fee grows with the amount, it must fit the budget left.
+        if self.sizer.adaptive and not self.fee_limit_fixed and self.fee_limit_percent:
+            with self.condition:
+                budget = self.max_total_fees - self.total_rebalance_fees - self.reserved_fees
+            target = min(target, int(budget * pow(10, 6) // int(self.fee_limit_percent)))
+        return target if target >= self.amount else None
+
+    def reserve_rebalance(self, amount=None) -> bool:
+        # Attempts in flight hold their worst case fee, so the budget is never overshot.
+        fee_limit = self.get_fee_limit(amount)
+        with self.condition:
+            while True:
+                total_fees = self.total_rebalance_fees + fee_limit
+                if total_fees > self.max_total_fees or self.total_rebalance_channels >= self.limit_rebalance:
+                    return False
+                if (total_fees + self.reserved_fees <= self.max_total_fees
+                        and self.total_rebalance_channels + self.reserved_channels < self.limit_rebalance):
+                    self.reserved_fees += fee_limit
+                    self.reserved_channels += 1
+                    return True
+
+                # Only attempts in flight are in the way, their budget comes back if they fail.
+                remaining = self.get_time_remaining()
+                if not remaining or self.stopped.is_set():
+                    return False
+                self.condition.wait(remaining)
+
+    def release_rebalance(self, fees=None, amount=None, rebalanced=None):
+        with self.condition:
+            self.reserved_fees -= self.get_fee_limit(amount)
+            self.reserved_channels -= 1
+            if fees is not None:
+                self.total_rebalance_fees += int(fees)
+                self.total_rebalance_amount += self.amount if rebalanced is None else int(rebalanced)
+                self.total_rebalance_channels += 1
+            self.condition.notify_all()
+
+    def exec_rebalance(self, channel: dict, amount=None):
+        # Concurrent attempts never share a peer, wait until both ends are free.
+        with self.condition:
+            while True:
+                channels_out = self.get_list_channels_feasible(channel, self.get_list_channels_candidates(channel))
+                if not channels_out:
+                    return {'error': True}
+
+                channels_out = list(filter(lambda x: x['remote_pubkey'] not in self.busy, channels_out))
+                if channels_out and channel['remote_pubkey'] not in self.busy:
+                    break
+                self.condition.wait()
+
+            channel_out = channels_out[0]
+            pair = (channel_out['chan_id'], channel['chan_id'])
+            amount = self.sizer.get_amount(pair, min(
+                self.amount if amount is None else amount, max(self.amount, self.get_surplus(channel_out))
+            ))
+            if amount is None:
+                return {'error': True}
+
+            busy = {channel['remote_pubkey'], channel_out['remote_pubkey']}
+            self.busy.update(busy)
+        timestamp = time()
+        try:
+            rebalance = self.executor.execute(self, channel_out, channel, amount)
+        finally:
+            self.report(channel)
+            with self.condition:
+                self.busy.difference_update(busy)
+                self.condition.notify_all()
+
+        latency = time() - timestamp
+        fees = 0 if rebalance['error'] else int(rebalance['fees'])
+        self.history.record(
+            channel_out['chan_id'],
+            channel['chan_id'],
+            amount,
+            fees,
+            latency,
+            rebalance.get('hops', []),
+            not rebalance['error']
+        )
+
+        executor = type(self.executor).__name__.replace('Executor', '').lower()
+        outcome = 'failure' if rebalance['error'] else 'success'
+        self.lnd.metrics.increment('attempts_total', executor=executor, outcome=outcome)
+        self.lnd.metrics.observe('attempt_seconds', latency, executor=executor, outcome=outcome)
+        self.lnd.metrics.record(
+            'attempt', executor=executor, outcome=outcome, chan_id_out=channel_out['chan_id'],
+            chan_id_in=channel['chan_id'], amount=amount, fees=fees, seconds=latency
+        )
+        if not rebalance['error']:
+            self.snapshot.state.mark([channel['chan_id'], channel_out['chan_id']])
+
+        # In adaptive mode a smaller size is worth another attempt until the pair reaches the minimum,
+        # a fixed amount stops at the first failure.
+        self.sizer.update(pair, amount, not rebalance['error'])
+        rebalance['amount'] = amount
+        rebalance['retry'] = (
+            rebalance['error'] and self.sizer.adaptive and self.sizer.get_amount(pair, amount) is not None
+        )
+        return rebalance
+
+    def run(self, parallel=1, callback=None, progress=None):
+        self.progress = progress
+
+        def rebalance_channel(channel_low_outbound: dict):
+            while int(time() - self.timestamp) < self.timeout and not self.stopped.is_set():
+                channel = self.snapshot.get_channel(channel_low_outbound['chan_id'])
+                if not channel or not self.parser_expr(channel):
+                    break
+                amount = self.get_amount_target(channel)
+                if amount is None or not self.reserve_rebalance(amount):
+                    break
+
+                # The reservation is given back even when the attempt raises, or the slot is lost for good.
+                fees, rebalance = None, {'error': True}
+                try:
+                    rebalance = self.exec_rebalance(channel_low_outbound, amount)
+                    if not rebalance['error']:
+                        fees = rebalance['fees']
+                finally:
+                    self.release_rebalance(fees, amount, rebalance.get('amount'))
+
+                if rebalance['error']:
+                    if not rebalance.get('retry'):
+                        break
+                elif callback:
+                    callback(rebalance, fees)
+
+        with ThreadPoolExecutor(max_workers=int(parallel)) as executor:
+            list(executor.map(rebalance_channel, self.get_list_channels_planned()))
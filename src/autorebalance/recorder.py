@@ -0,0 +1,96 @@
+from json import dumps, loads
+from time import time
+from gzip import open as gzip_open
+from threading import Lock
+from collections import deque
+from os.path import expanduser
+
+
+class Recorder:
+
+    replay = False
+
+    def __init__(self, path: str):
+        self.path = expanduser(path)
+        self.lock = Lock()
+        self.file = gzip_open(self.path, 'wt')
+        self.write('start', None, None)
+
+    @staticmethod
+    def get_key(key: object) -> str:
+        return dumps(key, sort_keys=True)
+
+    def write(self, kind: str, key: object, response: object, elapsed=0.0):
+        entry = {'timestamp': time(), 'kind': kind, 'key': self.get_key(key), 'elapsed': elapsed, 'response': response}
+        with self.lock:
+            self.file.write(dumps(entry) + '\n')
+
+    def play(self, kind: str, key: object, function: object) -> object:
+        timestamp = time()
+        response = function()
+        self.write(kind, key, response, time() - timestamp)
+        return response
+
+    def stream(self, kind: str, key: object, function: object):
+        # Lines are recorded even when the reader stops early.
+        timestamp, lines, stream = time(), [], function()
+        try:
+            for line in stream:
+                lines.append(line)
+                yield line
+        finally:
+            stream.close()
+            self.write(kind, key, lines, time() - timestamp)
+
+    def sync_history(self, history: object):
+        # The planner ranks pairs from past attempts, they are part of the inputs of a run.
+        with history.lock:
+            rows = history.connection.execute(
+                'SELECT timestamp, chan_id_out, chan_id_in, hops, success, amount FROM attempts WHERE timestamp > ? '
+                'ORDER BY timestamp', (time() - 10 * history.half_life, )
+            ).fetchall()
+        self.write('history', None, [[row[0], row[1], row[2], loads(row[3]), row[4], row[5]] for row in rows])
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class Replayer:
+
+    replay = True
+
+    def __init__(self, path: str):
+        self.path = expanduser(path)
+        self.lock = Lock()
+        self.responses = {}
+        self.timestamp = time()
+        with gzip_open(self.path, 'rt') as file:
+            for line in file:
+                entry = loads(line)
+                if entry['kind'] == 'start':
+                    self.timestamp = entry['timestamp']
+                self.responses.setdefault((entry['kind'], entry['key']), deque()).append(entry['response'])
+
+    def get(self, kind: str, key: object) -> object:
+        # Responses are served in recorded order, the last one is repeated once they run out.
+        with self.lock:
+            responses = self.responses.get((kind, Recorder.get_key(key)))
+            if not responses:
+                raise LookupError(f'No recorded {kind} response for {Recorder.get_key(key)}')
+            return responses.popleft() if len(responses) > 1 else responses[0]
+
+    def play(self, kind: str, key: object, function: object) -> object:
+        return self.get(kind, key)
+
+    def stream(self, kind: str, key: object, function: object):
+        yield from self.get(kind, key)
+
+    def sync_history(self, history: object):
+        # Attempts keep the age they had when recorded, so decayed scores match the recorded run.
+        offset = time() - self.timestamp
+        for timestamp, chan_id_out, chan_id_in, hops, success, amount in self.get('history', None):
+            history.learn(timestamp + offset, chan_id_out, chan_id_in, hops, bool(success), amount)
+
+    def close(self):
+        pass
@@ -0,0 +1,57 @@
+from functools import lru_cache
+
+import ast
+
+VARIABLES = (
+    'REMOTE_AVAILABLE_PERCENTAGE', 'LOCAL_AVAILABLE_PERCENTAGE',
+    'LOCAL_AVAILABLE', 'REMOTE_AVAILABLE', 'CAPACITY_AVAILABLE',
+    'LOCAL_FEE_RATE', 'LOCAL_FEE_BASE',
+    'REMOTE_FEE_RATE', 'REMOTE_FEE_BASE'
+)
+
+NODES = (
+    ast.Expression, ast.Name, ast.Load, ast.Constant,
+    ast.BoolOp, ast.And, ast.Or,
+    ast.UnaryOp, ast.Not, ast.USub, ast.UAdd,
+    ast.BinOp, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod,
+    ast.Compare, ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE
+)
+
+@lru_cache(maxsize=None)
+def compile_rule(expression: str):
+    expression = expression.strip()
+    if expression.upper().startswith('IF(') and expression.endswith(')'):
+        expression = expression[3:-1]
+    try:
+        tree = ast.parse(expression, mode='eval')
+    except SyntaxError:
+        raise ValueError(f'Invalid expression: {expression}')
+
+    for node in ast.walk(tree):
+        if not isinstance(node, NODES):
+            raise ValueError(f'Unsupported syntax {type(node).__name__} in expression: {expression}')
+        if isinstance(node, ast.Name) and node.id not in VARIABLES:
+            raise ValueError(f'Unknown variable {node.id} in expression: {expression}')
+        if isinstance(node, ast.Constant) and type(node.value) not in (int, float, bool):
+            raise ValueError(f'Unsupported constant {node.value!r} in expression: {expression}')
+    return compile(tree, '<expression>', 'eval')
+
+
+class Rules:
+
+    def __init__(self, expressions=[]):
+        self.expressions = list(expressions)
+        self.predicates = [compile_rule(expression) for expression in self.expressions]
+
+    def evaluate(self, variables: dict) -> bool:
+        for predicate in self.predicates:
+            # A division by an empty balance makes the rule false for that channel, not the whole run.
+            try:
+                if not eval(predicate, {'__builtins__': {}}, variables):
+                    return False
+            except ArithmeticError:
+                return False
+        return True
+
+    def filter(self, channels: dict) -> set:
+        return set(chan_id for chan_id, variables in channels.items() if self.evaluate(variables))
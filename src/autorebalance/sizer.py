@@ -0,0 +1,52 @@
+class Sizer:
+
+    def __init__(self, amount: int, max_amount=0, adaptive=False, growth=2.0):
+        self.amount = int(amount)
+        self.max_amount = int(max_amount or 0)
+        self.adaptive = bool(adaptive)
+        self.growth = float(growth)
+        self.working = {}
+        self.failed = {}
+
+    def reset(self):
+        self.working.clear()
+        self.failed.clear()
+
+    def get_target(self, deficit: int) -> int:
+        # The amount is never below the configured one, which stays the minimum size.
+        if not self.adaptive:
+            return self.amount
+        target = max(self.amount, int(deficit))
+        return min(target, self.max_amount) if self.max_amount else target
+
+    def get_amount(self, pair: tuple, target: int) -> int:
+        if not self.adaptive:
+            return self.amount
+
+        # Bisection between the largest size that went through and the smallest that failed.
+        working, failed = self.working.get(pair), self.failed.get(pair)
+        if working and failed:
+            amount = working if failed - working < self.amount else (working + failed) // 2
+        elif failed:
+            amount = failed // 2
+        elif working:
+            amount = int(working * self.growth)
+        else:
+            amount = target
+
+        amount = min(amount, int(target))
+        return amount if amount >= self.amount else None
+
+    def update(self, pair: tuple, amount: int, success: bool):
+        if not self.adaptive:
+            return
+
+        # Balances move between attempts, a bound contradicted by the last result is dropped.
+        if success:
+            self.working[pair] = max(self.working.get(pair, 0), amount)
+            if self.failed.get(pair, amount + 1) <= amount:
+                del self.failed[pair]
+        else:
+            self.failed[pair] = min(self.failed.get(pair, amount), amount)
+            if self.working.get(pair, 0) >= amount:
+                del self.working[pair]
@@ -0,0 +1,124 @@
+from base64 import b64decode
+from threading import Event, RLock, Thread
+from requests.exceptions import RequestException
+
+
+class ChannelState:
+
+    def __init__(self, lnd: object, stream=False, reconnect=5):
+        self.lnd = lnd
+        self.stream = stream
+        self.reconnect = reconnect
+        self.channels = {}
+        self.dirty = set()
+        self.stale = True
+        self.version = 0
+        self.lock = RLock()
+        self.stopped = Event()
+        self.threads = []
+
+    @staticmethod
+    def get_channel_point(channel_point: dict) -> str:
+        funding_txid = channel_point.get('funding_txid_str')
+        if not funding_txid:
+            funding_txid = b64decode(channel_point.get('funding_txid_bytes', ''))[::-1].hex()
+        return f'{funding_txid}:{channel_point.get("output_index", 0)}'
+
+    def start(self):
+        if self.stream and not self.threads:
+            for path, handler in (
+                ('v1/channels/subscribe', self.apply_channel_event),
+                ('v2/router/htlcevents', self.apply_htlc_event)
+            ):
+                thread = Thread(target=self.listen, args=(path, handler), daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def stop(self):
+        self.stopped.set()
+
+    def listen(self, path: str, handler: object):
+        while not self.stopped.is_set():
+            try:
+                for event in self.lnd.subscribe(path):
+                    if self.stopped.is_set():
+                        return
+                    handler(event)
+            except (RequestException, ValueError):
+                pass
+            # Events may have been missed while disconnected.
+            with self.lock:
+                self.stale = True
+            self.stopped.wait(self.reconnect)
+
+    def apply_channel_event(self, event: dict):
+        with self.lock:
+            if event.get('type') == 'OPEN_CHANNEL':
+                channel = event['open_channel']
+                if channel.get('active'):
+                    self.channels[channel['chan_id']] = channel
+                    self.version += 1
+            elif event.get('type') == 'CLOSED_CHANNEL':
+                chan_id = event['closed_channel'].get('chan_id')
+                self.dirty.discard(chan_id)
+                if self.channels.pop(chan_id, None):
+                    self.version += 1
+            elif event.get('type') == 'INACTIVE_CHANNEL':
+                channel_point = self.get_channel_point(event['inactive_channel'])
+                for chan_id, channel in list(self.channels.items()):
+                    if channel.get('channel_point') == channel_point:
+                        del self.channels[chan_id]
+                        self.dirty.discard(chan_id)
+                        self.version += 1
+            elif event.get('type') == 'ACTIVE_CHANNEL':
+                self.stale = True
+
+    def apply_htlc_event(self, event: dict):
+        # Settled HTLCs move balance, the affected channels are fetched again on the next read.
+        if 'settle_event' in event:
+            self.mark([event.get('incoming_channel_id'), event.get('outgoing_channel_id')])
+
+    def mark(self, chan_ids: list):
+        with self.lock:
+            self.dirty.update(chan_id for chan_id in chan_ids if chan_id in self.channels)
+
+    def invalidate(self):
+        with self.lock:
+            self.stale = True
+
+    def load(self):
+        with self.lock:
+            self.channels = {channel['chan_id']: channel for channel in self.lnd.get_list_channels()}
+            self.dirty.clear()
+            self.stale = False
+            self.version += 1
+
+    def poll(self):
+        with self.lock:
+            if self.stale:
+                return self.load()
+            if not self.dirty:
+                return
+
+            # A channel may have been closed after it was marked.
+            pub_keys = list(set(
+                self.channels[chan_id]['remote_pubkey'] for chan_id in self.dirty if chan_id in self.channels
+            ))
+            self.dirty.clear()
+            if not pub_keys:
+                return
+            for chan_id, channel in list(self.channels.items()):
+                if channel['remote_pubkey'] in pub_keys:
+                    del self.channels[chan_id]
+            for channels in self.lnd.get_list_channels_peers(pub_keys):
+                self.channels.update({channel['chan_id']: channel for channel in channels})
+            self.version += 1
+
+    def get_channels(self) -> dict:
+        self.poll()
+        return self.channels
+
+    def get_channel(self, chan_id: int) -> dict:
+        if self.stale or self.dirty:
+            self.poll()
+        return self.channels.get(chan_id)
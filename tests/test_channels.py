@@ -0,0 +1,29 @@
+from autorebalance.channels import ChannelTable
+
+CHANNELS = [
+    {
+        'chan_id': '1', 'remote_pubkey': '02a', 'capacity': '1000000', 'local_balance': '810000',
+        'remote_balance': '180000', 'local_chan_reserve_sat': '10000', 'remote_chan_reserve_sat': '10000'
+    },
+    {
+        'chan_id': '2', 'remote_pubkey': '02b', 'capacity': '1000000', 'local_balance': '110000',
+        'remote_balance': '880000', 'local_chan_reserve_sat': '10000', 'remote_chan_reserve_sat': '10000'
+    }
+]
+POLICIES = [{'fee_base_msat': '1000', 'fee_rate_milli_msat': '500'}, None]
+
+
+def test_row():
+    table = ChannelTable(CHANNELS, POLICIES, POLICIES)
+    row = table.row('2')
+    assert repr(row) == "ChannelRow(chan_id='2')"
+    assert row.local_available == 100_000
+    assert row.local_available_percentage == 10
+    assert row.local_fee_rate == 0
+    assert table.row('1').local_fee_rate == 500
+
+
+def test_outbound():
+    table = ChannelTable(CHANNELS, POLICIES, POLICIES)
+    assert table.get_low_outbound(range(len(table))) == [1]
+    assert table.get_high_outbound(range(len(table))) == [0]
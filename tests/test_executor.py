@@ -0,0 +1,63 @@
+from autorebalance.executor import BosParser, LndExecutor
+from autorebalance.rebalance import Rebalance
+
+import pytest
+
+OUTPUT = '''outgoing_peer_to_increase_inbound: Cherry 03aaaa
+incoming_peer_to_decrease_inbound: Strawberry 03bbbb
+rebalance_target_amount: 0.00100000
+evaluating:
+  - Cherry 03aaaa. Fee rate: 0.01% (100)
+  - Strawberry 03bbbb. Fee rate: 0.01% (100)
+rebalance:
+  - increased_inbound_on: Cherry
+  - decreased_inbound_on: Strawberry
+  - rebalanced: 0.00100000
+    rebalance_fees_spent: {fees}
+    rebalance_fee_rate: 0.01% (100)
+'''
+
+
+class FakeLnd:
+
+    @staticmethod
+    def get_node_alias(pub_key: str) -> str:
+        return f'alias-{pub_key}'
+
+
+def test_bos_output():
+    result = Rebalance.parser_rebalance(OUTPUT.format(fees='0.00000029'))
+    assert not result['error']
+    assert result['fees'] == 29
+    assert [hop['alias'] for hop in result['hops']] == ['Cherry', 'Strawberry']
+    assert result['rebalance']['rebalanced'] == '0.00100000'
+
+
+def test_bos_fees_are_exact():
+    for fees in range(10_000):
+        assert Rebalance.parser_rebalance(OUTPUT.format(fees=f'{fees / pow(10, 8):.8f}'))['fees'] == fees
+
+
+@pytest.mark.parametrize('line', [
+    'err: FailedToFindPathBetweenPeers',
+    '  err: stopped',
+    '[400,"FailedToFindPathBetweenPeers"]',
+    '[ 503, "UnexpectedErrorRebalancing" ]'
+])
+def test_bos_failure(line: str):
+    assert Rebalance.parser_rebalance(f'evaluating:\n{line}\n')['error']
+
+
+def test_bos_pretty_printed_failure():
+    parser = BosParser()
+    assert parser.feed('[')
+    assert not parser.feed('  400,')
+    assert parser.get_result() == {'error': True}
+
+
+@pytest.mark.parametrize('msat, sats', [(0, 0), (999, 1), (3000, 3), (3001, 4), (29_000, 29)])
+def test_route_fees_round_up(msat: int, sats: int):
+    route = {'total_fees_msat': str(msat), 'hops': [{'pub_key': '02a'}, {'pub_key': '02b'}]}
+    result = LndExecutor.parser_route(FakeLnd(), route)
+    assert result['fees'] == sats
+    assert result['hops'] == [{'alias': 'alias-02a', 'pubkey': '02a'}]
@@ -0,0 +1,50 @@
+from types import SimpleNamespace
+
+from autorebalance.history import History
+from autorebalance.planner import Planner
+
+
+def get_table() -> object:
+    return SimpleNamespace(
+        chan_ids=['out1', 'out2', 'in'],
+        remote_pubkeys=['02a', '02b', '02c'],
+        local_available=[900_000, 900_000, 100_000],
+        capacity_available=[1_000_000, 1_000_000, 1_000_000],
+        local_fee_rate=[2_000, 2_000, 0]
+    )
+
+
+def test_likelier_pair_ranks_first():
+    # The in channel charges less than the out channels, the score must still favour past successes.
+    history = History()
+    for _ in range(5):
+        history.record('out1', 'in', 100_000, 0, 1, [], True)
+    history.record('out2', 'in', 100_000, 0, 1, [], False)
+
+    pairs = Planner(100_000, history).rank(get_table(), [0, 1], [2])
+    assert [index_out for _, index_out, _ in pairs] == [0, 1]
+    assert all(score >= 0 for score, _, _ in pairs)
+
+
+def test_failures_above_the_minimum_do_not_kill_a_pair():
+    history = History()
+    for amount in (800_000, 400_000, 200_000):
+        history.record('out1', 'in', amount, 0, 1, [], False)
+
+    planner = Planner(100_000, history)
+    assert not planner.is_dead('out1', 'in')
+    history.record('out1', 'in', 100_000, 0, 1, [], False)
+    history.record('out1', 'in', 100_000, 0, 1, [], False)
+    assert planner.is_dead('out1', 'in')
+
+
+def test_failure_amounts_are_persisted(tmp_path):
+    path = str(tmp_path / 'history.db')
+    history = History(path=path)
+    history.record('out1', 'in', 400_000, 0, 1, [], False)
+    history.record('out1', 'in', 400_000, 0, 1, [], False)
+    history.close()
+
+    history = History(path=path)
+    assert not Planner(100_000, history).is_dead('out1', 'in')
+    assert Planner(400_000, history).is_dead('out1', 'in')
@@ -0,0 +1,82 @@
+from autorebalance.rules import Rules, compile_rule
+
+import pytest
+
+VARIABLES = {
+    'LOCAL_FEE_RATE': 500,
+    'LOCAL_FEE_BASE': 1000,
+    'REMOTE_FEE_RATE': 100,
+    'REMOTE_FEE_BASE': 1000,
+    'LOCAL_AVAILABLE': 200_000,
+    'REMOTE_AVAILABLE': 800_000,
+    'CAPACITY_AVAILABLE': 1_000_000,
+    'LOCAL_AVAILABLE_PERCENTAGE': 20,
+    'REMOTE_AVAILABLE_PERCENTAGE': 80
+}
+
+
+@pytest.mark.parametrize('expression, expected', [
+    ('LOCAL_FEE_RATE > REMOTE_FEE_RATE', True),
+    ('IF(LOCAL_FEE_RATE > REMOTE_FEE_RATE)', True),
+    ('if(LOCAL_AVAILABLE_PERCENTAGE >= 50)', False),
+    ('LOCAL_AVAILABLE * 4 == REMOTE_AVAILABLE and not REMOTE_FEE_BASE != 1000', True),
+    ('LOCAL_AVAILABLE / CAPACITY_AVAILABLE < 0.5 or LOCAL_FEE_RATE < 0', True),
+    ('-LOCAL_FEE_RATE + +REMOTE_FEE_RATE < LOCAL_FEE_BASE // 3 % 7', True),
+    ('1 < LOCAL_AVAILABLE_PERCENTAGE <= 20', True),
+    ('True', True)
+])
+def test_evaluate(expression: str, expected: bool):
+    assert Rules([expression]).evaluate(VARIABLES) is expected
+
+
+def test_every_rule_must_hold():
+    assert Rules(['LOCAL_FEE_RATE > 0', 'REMOTE_FEE_RATE > 0']).evaluate(VARIABLES)
+    assert not Rules(['LOCAL_FEE_RATE > 0', 'REMOTE_FEE_RATE > 1000']).evaluate(VARIABLES)
+    assert Rules([]).evaluate(VARIABLES)
+
+
+@pytest.mark.parametrize('expression', [
+    'LOCAL_AVAILABLE / REMOTE_AVAILABLE >= 0',
+    'LOCAL_AVAILABLE // REMOTE_AVAILABLE >= 0',
+    'LOCAL_AVAILABLE % REMOTE_AVAILABLE >= 0'
+])
+def test_division_by_zero_is_not_eligible(expression: str):
+    rules = Rules([expression])
+    channels = {'1': dict(VARIABLES, REMOTE_AVAILABLE=0), '2': VARIABLES}
+    assert not rules.evaluate(channels['1'])
+    assert rules.filter(channels) == {'2'}
+
+
+@pytest.mark.parametrize('expression', [
+    '__import__("os").system("true")',
+    'open("/etc/passwd")',
+    'LOCAL_FEE_RATE.__class__',
+    '().__class__.__bases__[0].__subclasses__()',
+    '[LOCAL_FEE_RATE][0] > 0',
+    '(lambda: 1)()',
+    '[x for x in (1, 2)]',
+    '(x := 1)',
+    'LOCAL_FEE_RATE if True else 0',
+    'LOCAL_FEE_RATE ** 1000000',
+    'LOCAL_FEE_RATE << 64',
+    'LOCAL_FEE_RATE in (1, 2)',
+    'LOCAL_FEE_RATE is 1',
+    '"a" == "a"',
+    'b"a" == b"a"',
+    '... == ...',
+    'None == None',
+    'f"{LOCAL_FEE_RATE}" == "1"',
+    'UNKNOWN_VARIABLE > 0',
+    '__builtins__',
+    'local_fee_rate > 0'
+])
+def test_rejected(expression: str):
+    with pytest.raises(ValueError):
+        compile_rule(expression)
+
+
+@pytest.mark.parametrize('expression', ['LOCAL_FEE_RATE >', 'IF(', 'LOCAL_FEE_RATE = 1', ''])
+def test_invalid_syntax(expression: str):
+    with pytest.raises(ValueError):
+        compile_rule(expression)
+
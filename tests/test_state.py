@@ -0,0 +1,89 @@
+from base64 import b64encode
+
+from autorebalance.state import ChannelState
+
+TXID = 'ab' * 31 + '01'
+
+
+class FakeLnd:
+
+    def __init__(self, channels: list):
+        self.channels = channels
+        self.requests = []
+
+    def get_list_channels(self) -> list:
+        self.requests.append('channels')
+        return [dict(channel) for channel in self.channels if channel['active']]
+
+    def get_list_channels_peers(self, pub_keys: list) -> list:
+        self.requests.append(sorted(pub_keys))
+        return [
+            [dict(channel) for channel in self.channels if channel['remote_pubkey'] == pub_key and channel['active']]
+            for pub_key in pub_keys
+        ]
+
+
+def get_state() -> tuple:
+    lnd = FakeLnd([
+        {'chan_id': '1', 'remote_pubkey': '02a', 'channel_point': f'{TXID}:0', 'local_balance': '100', 'active': True},
+        {'chan_id': '2', 'remote_pubkey': '02b', 'channel_point': f'{"cd" * 32}:1', 'local_balance': '200', 'active': True}
+    ])
+    state = ChannelState(lnd)
+    state.get_channels()
+    return lnd, state
+
+
+def settle(state: ChannelState):
+    state.apply_htlc_event({'incoming_channel_id': '1', 'outgoing_channel_id': '2', 'settle_event': {}})
+
+
+def test_settle_refreshes_the_peers():
+    lnd, state = get_state()
+    version = state.version
+    lnd.channels[0]['local_balance'] = '150'
+    settle(state)
+    assert state.get_channel('1')['local_balance'] == '150'
+    assert state.version == version + 1
+    assert lnd.requests == ['channels', ['02a', '02b']]
+
+
+def test_channel_point_bytes_are_reversed():
+    _, state = get_state()
+    version = state.version
+    funding_txid_bytes = b64encode(bytes.fromhex(TXID)[::-1]).decode()
+    state.apply_channel_event({
+        'type': 'INACTIVE_CHANNEL', 'inactive_channel': {'funding_txid_bytes': funding_txid_bytes, 'output_index': 0}
+    })
+    assert '1' not in state.get_channels()
+    assert state.version == version + 1
+
+
+def test_settle_then_inactive():
+    lnd, state = get_state()
+    settle(state)
+    lnd.channels[0]['active'] = False
+    state.apply_channel_event({
+        'type': 'INACTIVE_CHANNEL', 'inactive_channel': {'funding_txid_str': TXID, 'output_index': 0}
+    })
+    assert state.get_channel('1') is None
+    assert list(state.get_channels()) == ['2']
+
+
+def test_settle_then_closed():
+    lnd, state = get_state()
+    settle(state)
+    state.apply_channel_event({'type': 'CLOSED_CHANNEL', 'closed_channel': {'chan_id': '1'}})
+    state.apply_channel_event({'type': 'CLOSED_CHANNEL', 'closed_channel': {'chan_id': '2'}})
+    assert state.get_channels() == {}
+    assert lnd.requests == ['channels']
+
+
+def test_open_and_active():
+    lnd, state = get_state()
+    state.apply_channel_event({
+        'type': 'OPEN_CHANNEL', 'open_channel': {'chan_id': '3', 'remote_pubkey': '02c', 'active': True}
+    })
+    assert '3' in state.get_channels()
+    state.apply_channel_event({'type': 'ACTIVE_CHANNEL', 'active_channel': {}})
+    assert list(state.get_channels()) == ['1', '2']
+    assert lnd.requests == ['channels', 'channels']